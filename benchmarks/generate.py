@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""Write a synthetic taskwarrior database, for benchmarking taskwarrior-deluxe.
+
+The database is made of taskwarrior 2.x `.data` files in `<dir>/.task`,
+along with a `<dir>/.taskrc` declaring the UDAs.
+The same seed always produces the same tasks (dates are relative to `--now`).
+"""
+
+import os
+import sys
+import time
+import random
+import pathlib
+import argparse
+
+words = """
+    add allow board bug card change check clean color config daemon data date
+    display doc edit export field filter fix group icon include layout list make
+    merge move note option panel parse priority project refactor release remove
+    render report repo section sheet show sort stack start status swatch table
+    tag task test theme update urgency view widget wrap write
+""".split()
+
+
+def escape(value):
+    """Escape a value the way taskwarrior does in its `.data` files."""
+    return value.replace("\\", "\\\\").replace('"', "&dquot;").replace("[", "&open;").replace("]", "&close;")
+
+
+def sentence(rng, length):
+    """About `length` characters of random words."""
+    out = []
+    n = 0
+    while n < length:
+        w = rng.choice(words)
+        out.append(w)
+        n += len(w) + 1
+    return " ".join(out)
+
+
+def make_task(rng, args, now):
+    entry = now - rng.randint(0, 365 * 86400)
+    task = {
+        "uuid": "%08x-%04x-4%03x-%04x-%012x" % (rng.getrandbits(32), rng.getrandbits(16),
+            rng.getrandbits(12), rng.getrandbits(16) & 0x3fff | 0x8000, rng.getrandbits(48)),
+        "description": sentence(rng, rng.randint(10, 80)),
+        "entry": entry,
+        "modified": rng.randint(entry, now),
+        "status": "pending",
+    }
+    if rng.random() < 0.7:
+        task["priority"] = rng.choice("HML")
+    if rng.random() < 0.5:
+        task["project"] = rng.choice(["board", "config", "data", "render", "repos"])
+    ntags = rng.choice([0, 1, 1, 2, 3])
+    if ntags and args.tags:
+        task["tags"] = sorted({f"tag{rng.randrange(args.tags)}" for _ in range(ntags)})
+    for field in ["due", "scheduled", "wait"]:
+        if rng.random() < args.dates:
+            task[field] = now + rng.randint(-30 * 86400, 60 * 86400)
+    if rng.random() < 0.1:
+        task["start"] = rng.randint(entry, now)
+    for i in range(args.udas):
+        if rng.random() < 0.5:
+            task[f"uda{i}"] = str(rng.randint(1, 13)) if i % 2 else rng.choice(["front", "back", "ops"])
+    if args.annotations and rng.random() < 0.3:
+        for _ in range(rng.randint(1, 3)):
+            task[f"annotation_{rng.randint(entry, now)}"] = sentence(rng, args.annotations)
+    r = rng.random()
+    if r < args.completed:
+        task["status"] = "completed"
+        task["end"] = rng.randint(task["modified"], now)
+        task.pop("start", None)
+    elif r < args.completed + 0.02:
+        task["status"] = "deleted"
+        task["end"] = rng.randint(task["modified"], now)
+    return task
+
+
+def data_line(task):
+    pairs = []
+    for k in sorted(task):
+        v = task[k]
+        if k == "tags":
+            pairs.append(f'tags:"{",".join(v)}"')
+            pairs += [f'tags_{t}:"x"' for t in v]
+        else:
+            pairs.append(f'{k}:"{escape(str(v))}"')
+    return "[" + " ".join(pairs) + "]\n"
+
+
+def generate(path, args):
+    """Write `args.tasks` tasks in the database at `path`, returns the path of the `.task` directory."""
+    rng = random.Random(args.seed)
+    path = pathlib.Path(path)
+    data = path / ".task"
+    data.mkdir(parents = True, exist_ok = True)
+    with open(path / ".taskrc", "w") as fd:
+        for i in range(args.udas):
+            fd.write(f"uda.uda{i}.type={'numeric' if i % 2 else 'string'}\n")
+            fd.write(f"uda.uda{i}.label=UDA {i}\n")
+    with open(data / "pending.data", "w") as pending, open(data / "completed.data", "w") as completed:
+        for _ in range(args.tasks):
+            task = make_task(rng, args, args.now)
+            if task["status"] == "pending":
+                pending.write(data_line(task))
+            else:
+                completed.write(data_line(task))
+    for name in ["backlog.data", "undo.data"]:
+        (data / name).touch()
+    return data
+
+
+def parser():
+    p = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    p.add_argument("dir", help = "where to write the database")
+    p.add_argument("-n", "--tasks", type = int, default = 1000, help = "number of tasks (default: %(default)s)")
+    p.add_argument("--tags", type = int, default = 20, help = "number of distinct tags (default: %(default)s)")
+    p.add_argument("--dates", type = float, default = 0.3,
+        help = "probability for a task to have each of due, scheduled and wait (default: %(default)s)")
+    p.add_argument("--udas", type = int, default = 2, help = "number of UDAs (default: %(default)s)")
+    p.add_argument("--annotations", type = int, default = 40,
+        help = "length of the annotations, 0 for none (default: %(default)s)")
+    p.add_argument("--completed", type = float, default = 0.3,
+        help = "ratio of completed tasks (default: %(default)s)")
+    p.add_argument("--repos", type = int, default = 0,
+        help = "number of subdirectories holding their own (small) database (default: %(default)s)")
+    p.add_argument("--seed", type = int, default = 0, help = "random seed (default: %(default)s)")
+    p.add_argument("--now", type = int, default = int(time.time()), help = "reference epoch of the dates")
+    return p
+
+
+def main(argv):
+    args = parser().parse_args(argv)
+    generate(args.dir, args)
+    for i in range(args.repos):
+        sub = argparse.Namespace(**{**vars(args), "tasks": max(1, args.tasks // 100), "seed": args.seed + i + 1})
+        generate(os.path.join(args.dir, f"repo{i}"), sub)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+"""Benchmark the layers of taskwarrior-deluxe on synthetic databases.
+
+For each size, a database is generated (see `generate.py`), then each case
+is timed over several repetitions and run once more under tracemalloc to
+measure its peak memory. Results are printed and can be saved as JSON,
+to be compared with a previous run:
+
+    python3 benchmarks/run.py --sizes 100,1000 --output before.json
+    python3 benchmarks/run.py --sizes 100,1000 --compare before.json
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import platform
+import tempfile
+import argparse
+import statistics
+import subprocess
+import tracemalloc
+import importlib.util
+import importlib.metadata
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, here)
+import generate
+
+# The script is not a module, load it by path.
+spec = importlib.util.spec_from_file_location("twd", os.path.join(here, "..", "taskwarrior-deluxe.py"))
+twd = importlib.util.module_from_spec(spec)
+# Registered, so that the worker processes rendering sections can unpickle its objects.
+sys.modules["twd"] = twd
+spec.loader.exec_module(twd)
+
+presets = os.path.join(here, "..", "presets")
+
+
+def make_config(root, **layout):
+    """Default config, with the UDAs of the generated database, colors and icons."""
+    config = dict(twd.default_conf)
+    for name in [os.path.join(root, ".taskrc"),
+                 os.path.join(presets, "colors_nojhan.conf"),
+                 os.path.join(presets, "icons_ascii.conf")]:
+        config = twd.parse_config(name, config)
+    config.update(layout)
+    return config
+
+
+def console(config, width = 160):
+    return twd.rich.console.Console(theme = twd.rich.theme.Theme(twd.get_swatch(config)),
+        file = io.StringIO(), width = width, force_terminal = True, color_system = "truecolor")
+
+
+def fresh():
+    """Forget what is memoized across calls, as each run of the command line would."""
+    twd.Dates.reset()
+    twd.Swatches.compiled.clear()
+
+
+class Case:
+    """A measured operation.
+
+    `setup` is called once per size and returns the argument of `run`,
+    which is the only part that is timed.
+    """
+    def __init__(self, name, setup, run):
+        self.name = name
+        self.setup = setup
+        self.run = run
+
+
+def setup_tasks(root, **layout):
+    config = make_config(root, **layout)
+    tasks = twd.read_data(os.path.join(root, ".task"), config)
+    return config, tasks
+
+
+def export_output(tasks):
+    """The tasks as `task export` writes them: one per line."""
+    return ("[\n" + ",\n".join(json.dumps(t) for t in tasks) + "\n]\n").encode()
+
+
+def setup_export(root):
+    config, tasks = setup_tasks(root)
+    return export_output(tasks), None
+
+
+def setup_compact(root):
+    config, tasks = setup_tasks(root)
+    return export_output(tasks), twd.Projection(twd.projected_fields(config))
+
+
+def run_decode(args):
+    out, projection = args
+    list(twd.decode_export(io.BytesIO(out), projection))
+
+
+def setup_layout(root, **layout):
+    config, tasks = setup_tasks(root, **layout)
+    return config, tasks, twd.make_layout(config)
+
+
+def run_group(args):
+    config, tasks, sectioner = args
+    fresh()
+    twd.GroupIndex(tasks, sectioner.groupers(), sectioner.leaf_sorter())
+
+
+def run_sort(args):
+    config, tasks, sectioner = args
+    fresh()
+    sectioner.leaf_sorter()(tasks)
+
+
+def run_tasks(args):
+    config, tasks, sectioner = args
+    fresh()
+    out = console(config)
+    tasker = sectioner
+    while isinstance(tasker, twd.Sectioner):
+        tasker = tasker.stacker
+    tasker = tasker.tasker
+    for task in tasks:
+        out.print(tasker(task))
+
+
+def run_swatches(args):
+    config, tasks, sectioner = args
+    fresh()
+    w = twd.Widget(config)
+    for task in tasks:
+        for k,v in task.items():
+            if type(v) == str:
+                w.swatch_of(k, v)
+
+
+def run_board(args):
+    config, tasks, sectioner = args
+    fresh()
+    twd.render_pool.configure(config)
+    console(config).print(sectioner(tasks))
+
+
+def run_output(args, format = "json"):
+    config, tasks, sectioner = args
+    fresh()
+    twd.write_board(format, sectioner, tasks, io.StringIO())
+
+
+def setup_scan(root):
+    config = make_config(root)
+    return root, config
+
+
+def run_scan(args):
+    root, config = args
+    taskfiles = twd.sub_taskfiles(root, None, config)
+    for taskfile,count in twd.RepoCounts(taskfiles):
+        pass
+
+
+sheets = {"layout.task": "Sheet", "layout.stack": "Vertical"}
+cards = {"layout.task": "Card", "layout.stack": "Flat", "layout.sections": "Vertical",
+    "layout.subsections": "Vertical", "layout.subsections.group": "priority"}
+
+kanban = {"layout.task": "Card", "layout.stack": "Vertical", "layout.sections": "Kanban",
+    "layout.subsections": "Vertical", "layout.subsections.group": "priority"}
+horizontal = dict(kanban, **{"layout.sections": "Horizontal"})
+limited = dict(cards, **{"layout.stack.limit": "20"})
+serial = {"layout.parallel.jobs": "0"}
+parallel = {"layout.parallel.jobs": "auto", "layout.parallel.min": "0"}
+
+cases = [
+    Case("decode.export", setup_export, run_decode),
+    Case("decode.compact", setup_compact, run_decode),
+    Case("decode.native", lambda root: (os.path.join(root, ".task"), make_config(root)),
+        lambda args: twd.read_data(*args)),
+    Case("group", lambda root: setup_layout(root, **cards), run_group),
+    Case("sort", setup_layout, run_sort),
+    Case("swatches", setup_layout, run_swatches),
+    Case("task.Sheet", lambda root: setup_layout(root, **sheets), run_tasks),
+    Case("task.Card", lambda root: setup_layout(root, **cards), run_tasks),
+    Case("board.RawTable", lambda root: setup_layout(root, **serial), run_board),
+    Case("board.Sheet", lambda root: setup_layout(root, **sheets, **serial), run_board),
+    Case("board.Card", lambda root: setup_layout(root, **cards, **serial), run_board),
+    Case("board.limited", lambda root: setup_layout(root, **limited, **serial), run_board),
+    Case("board.Horizontal", lambda root: setup_layout(root, **horizontal, **serial), run_board),
+    Case("board.Kanban", lambda root: setup_layout(root, **kanban, **serial), run_board),
+    Case("board.parallel.RawTable", lambda root: setup_layout(root, **parallel), run_board),
+    Case("board.parallel.Kanban", lambda root: setup_layout(root, **kanban, **parallel), run_board),
+    Case("output.json", setup_layout, run_output),
+    Case("output.html", setup_layout, lambda args: run_output(args, "html")),
+    Case("scan", setup_scan, run_scan),
+]
+
+
+def measure(case, arg, repeat, budget):
+    """Timings of at least one and at most `repeat` runs, stopping after `budget` seconds."""
+    times = []
+    start = time.perf_counter()
+    while len(times) < repeat and (not times or time.perf_counter() - start < budget):
+        t = time.perf_counter()
+        case.run(arg)
+        times.append(time.perf_counter() - t)
+    tracemalloc.start()
+    case.run(arg)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "min": min(times),
+        "median": statistics.median(times),
+        "repeat": len(times),
+        "peak": peak,
+    }
+
+
+def metadata():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd = here,
+            capture_output = True, text = True).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "rich": importlib.metadata.version("rich"),
+    }
+
+
+def human(seconds):
+    if seconds < 1e-3:
+        return f"{seconds*1e6:.0f} µs"
+    elif seconds < 1:
+        return f"{seconds*1e3:.1f} ms"
+    return f"{seconds:.2f} s"
+
+
+def header(previous = None):
+    print(f"{'case':<24} {'tasks':>7} {'min':>10} {'median':>10} {'peak':>10}" + (f" {'vs. old':>8}" if previous else ""))
+
+
+def report(name, size, r, previous = None):
+    line = f"{name:<24} {size:>7} {human(r['min']):>10} {human(r['median']):>10} {r['peak']/2**20:>7.1f} MB"
+    if previous:
+        # Ratio of the best timings, lower is better.
+        old = previous.get(name, {}).get(size)
+        line += f" {r['min']/old['min']:>7.2f}x" if old else f" {'-':>8}"
+    print(line, flush = True)
+
+
+def main(argv):
+    p = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--sizes", default = "100,1000,10000,100000",
+        help = "comma-separated numbers of tasks (default: %(default)s)")
+    p.add_argument("--cases", default = "",
+        help = "comma-separated prefixes of the cases to run, among: " + ", ".join(c.name for c in cases))
+    p.add_argument("--repeat", type = int, default = 5, help = "maximum number of timed runs (default: %(default)s)")
+    p.add_argument("--budget", type = float, default = 10,
+        help = "stop repeating a case after this many seconds (default: %(default)s)")
+    p.add_argument("--repos", type = int, default = 20,
+        help = "number of subdirectories databases, for the scan case (default: %(default)s)")
+    p.add_argument("--output", help = "save the results in this JSON file")
+    p.add_argument("--compare", help = "compare with the results saved in this JSON file")
+    args = p.parse_args(argv)
+
+    previous = None
+    if args.compare:
+        with open(args.compare) as fd:
+            previous = json.load(fd)["results"]
+
+    selected = [c for c in cases if not args.cases or any(c.name.startswith(s) for s in args.cases.split(","))]
+    results = {c.name: {} for c in selected}
+    now = int(time.time())
+    header(previous)
+    with tempfile.TemporaryDirectory(prefix = "twd-bench-") as tmp:
+        for size in [int(s) for s in args.sizes.split(",")]:
+            root = os.path.join(tmp, str(size))
+            generate.main([root, "--tasks", str(size), "--repos", str(args.repos), "--now", str(now)])
+            for case in selected:
+                r = measure(case, case.setup(root), args.repeat, args.budget)
+                results[case.name][str(size)] = r
+                report(case.name, str(size), r, previous)
+
+    if args.output:
+        with open(args.output, "w") as fd:
+            json.dump({"meta": metadata(), "results": results}, fd, indent = 4)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
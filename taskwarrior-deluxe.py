@@ -1,27 +1,204 @@
 #!/usr/bin/env python3
 
+import time
+startup = time.perf_counter()
+
 import os
 import re
 import sys
+import io
 import json
-import pytz
-import queue
 import pathlib
-import logging
-import textwrap
-import datetime
-import humanize
-import subprocess
+import importlib
+
+# Time spent importing modules, and when each step of the run started.
+import_times = {"(eager imports)": 0.0}
+startup_marks = []
+
+
+def mark(step):
+    startup_marks.append( (step, time.perf_counter()) )
+
+
+class LazyModule:
+    """A module that is only imported when one of its attributes is first used.
+
+    Submodules are imported the same way, so that `rich.panel.Panel` works
+    without importing `rich.panel` beforehand.
+    """
+    def __init__(self, name):
+        self.__dict__["_name"] = name
+        self.__dict__["_module"] = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self.__dict__["_module"] = timed_import(self._name)
+        try:
+            return getattr(self._module, attr)
+        except AttributeError:
+            return timed_import(f"{self._name}.{attr}")
+
+
+def timed_import(name):
+    known = name in sys.modules
+    start = time.perf_counter()
+    # Waits for the module to be initialized, if another thread is importing it.
+    module = importlib.import_module(name)
+    if not known:
+        import_times[name] = time.perf_counter() - start
+    return module
+
 
-import rich
-# For some reason this is not imported by the command above.
-from rich.console import Console
-from rich.columns import Columns
+def report_startup(file = sys.stderr):
+    print("Imports:", file=file)
+    for name,duration in sorted(import_times.items(), key = lambda i: i[1], reverse = True):
+        print(f"{duration*1000:8.1f} ms  {name}", file=file)
+    print("Steps:", file=file)
+    marks = [("(start)", startup)] + startup_marks + [("(end)", time.perf_counter())]
+    for (step,start),(_,end) in zip(marks[:-1], marks[1:]):
+        print(f"{(end-start)*1000:8.1f} ms  {step}", file=file)
+
+
+class Span:
+    def __init__(self, spans, name):
+        self.spans = spans
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.spans.append( (self.name, time.perf_counter() - self.start) )
+
+
+class NoSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+class Timings:
+    """Time spent in the named spans of a run, and in hot functions.
+
+    When disabled, spans do nothing and no function is wrapped,
+    so that the instrumentation can stay in place.
+    """
+    # Functions which calls are counted and timed, as "function" or "Class.method".
+    hot = [
+        "Widget.swatch_of", "Widget.rtext", "Widget.rdate", "Dates.humanize",
+        "GroupIndex.__init__", "call_taskwarrior", "find_config", "parse_config",
+        "read_data", "filter_data", "count_tasks",
+    ]
+    no_span = NoSpan()
+
+    def __init__(self):
+        self.enabled = False
+        self.spans = []
+        self.calls = {}
+        self.wrapped = []
+
+    def span(self, name):
+        if not self.enabled:
+            return self.no_span
+        return Span(self.spans, name)
+
+    def wrap(self, func, name):
+        calls = self.calls.setdefault(name, [0, 0.0])
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                calls[0] += 1
+                calls[1] += time.perf_counter() - start
+        return timed
+
+    def enable(self):
+        self.enabled = True
+        self.spans = []
+        self.calls = {}
+        self.begin = len(startup_marks)
+        self.start = time.perf_counter()
+        for name in self.hot:
+            owner, _, attr = name.rpartition(".")
+            owner = globals()[owner] if owner else sys.modules[__name__]
+            func = getattr(owner, attr)
+            self.wrapped.append( (owner, attr, func) )
+            setattr(owner, attr, self.wrap(func, name))
+
+    def disable(self):
+        for owner, attr, func in reversed(self.wrapped):
+            setattr(owner, attr, func)
+        self.wrapped = []
+        self.enabled = False
+
+    def records(self):
+        end = time.perf_counter()
+        marks = startup_marks[self.begin:] + [("(end)", end)]
+        yield {"kind": "total", "name": "run", "seconds": end - self.start}
+        for (step,start),(_,stop) in zip(marks[:-1], marks[1:]):
+            yield {"kind": "stage", "name": step, "seconds": stop - start}
+        for name,duration in self.spans:
+            yield {"kind": "span", "name": name, "seconds": duration}
+        for name,(count,duration) in sorted(self.calls.items(), key = lambda i: i[1][1], reverse = True):
+            if count:
+                yield {"kind": "function", "name": name, "calls": count, "seconds": duration}
+
+    def report(self, format = "table", file = None):
+        file = file if file else sys.stderr
+        if format == "json":
+            for record in self.records():
+                print(json.dumps(record), file=file)
+            return
+        kind = None
+        for record in self.records():
+            if record["kind"] != kind:
+                kind = record["kind"]
+                print({"total": "Run:", "stage": "Stages:", "span": "Spans:", "function": "Functions:"}[kind], file=file)
+            if kind == "function":
+                print(f"{record['seconds']*1000:8.1f} ms  {record['calls']:>8} calls  {record['name']}", file=file)
+            else:
+                print(f"{record['seconds']*1000:8.1f} ms  {record['name']}", file=file)
+
+timings = Timings()
+
+
+# Those are only needed by some commands and layouts.
+rich = LazyModule("rich")
+pytz = LazyModule("pytz")
+humanize = LazyModule("humanize")
+textwrap = LazyModule("textwrap")
+subprocess = LazyModule("subprocess")
+concurrent = LazyModule("concurrent")
+logging = LazyModule("logging")
+datetime = LazyModule("datetime")
+queue = LazyModule("queue")
+pickle = LazyModule("pickle")
+socket = LazyModule("socket")
+struct = LazyModule("struct")
+hashlib = LazyModule("hashlib")
+array = LazyModule("array")
+shutil = LazyModule("shutil")
+threading = LazyModule("threading")
+contextlib = LazyModule("contextlib")
+heapq = LazyModule("heapq")
+csv = LazyModule("csv")
+html = LazyModule("html")
+itertools = LazyModule("itertools")
+fnmatch = LazyModule("fnmatch")
+shlex = LazyModule("shlex")
+calendar = LazyModule("calendar")
+
+import_times["(eager imports)"] = time.perf_counter() - startup
 
 error_codes = {
     "NO_DATA_FILE": 100,
     "CANNOT_INIT": 200,
     "NO_DATA": 300,
+    "UNKNOWN_FORMAT": 400,
 }
 
 
@@ -30,65 +207,151 @@ def error(name,msg):
     sys.exit(error_codes[name])
 
 
+class Swatches:
+    """Resolve the style of (key, value) pairs, compiled once from a config.
+
+    Resolved styles are memoized in a bounded cache.
+    """
+    # Compiled swatches, by config.
+    compiled = {}
+
+    @classmethod
+    def of(cls, config, list_separator = ","):
+        if id(config) in cls.compiled and cls.compiled[id(config)].config is config:
+            return cls.compiled[id(config)]
+        if len(cls.compiled) > 8:
+            cls.compiled.clear()
+        swatches = cls(config, list_separator)
+        cls.compiled[id(config)] = swatches
+        return swatches
+
+    def __init__(self, config, list_separator = ",", size = 4096):
+        self.config = config
+        self.size = size
+        self.memo = {}
+        self.precedence = config.get("rule.precedence.color", "").split(list_separator)
+        # All the `color.<key>` and `color.<key>.<value>` entries.
+        self.colors = {k: v for k,v in config.items() if k.startswith("color.")}
+
+    def __call__(self, key, val, prefix = "color."):
+        try:
+            return self.memo[(key, val, prefix)]
+        except KeyError:
+            pass
+        swatch = self.resolve(key, val, prefix)
+        if len(self.memo) >= self.size:
+            # Forget the oldest entry.
+            del self.memo[next(iter(self.memo))]
+        self.memo[(key, val, prefix)] = swatch
+        return swatch
+
+    def resolve(self, key, val, prefix = "color."):
+        if not key:
+            return ""
+        colors = self.colors if prefix.startswith("color.") else self.config
+        key = prefix+key
+        value = re.sub(r"\s", "_", val)
+        keyval = f"{key}.{value}"
+        if key in colors and keyval in colors:
+            # "on" in key and not in keyval.
+            if   "on"     in colors[key] and "on" not in colors[keyval]:
+                return f"{colors[keyval]} {colors[key]}"
+            # "on" not in key and in keyval.
+            elif "on" not in colors[key] and "on"     in colors[keyval]:
+                return f"{colors[key]} {colors[keyval]}"
+            else: # "on" not in key and not in keyval or "on" in key and in keyval
+                # Defaults to keyval having precedence if nothing is specified.
+                swatch = colors[keyval]
+                for k in self.precedence: # FIXME reverse precedence?
+                    if k in keyval:
+                        swatch = colors[keyval]
+                        break
+                    if k in key:
+                        swatch = colors[key]
+                        break
+                return swatch
+        elif key in colors:
+            return colors[key]
+        elif keyval in colors:
+            return colors[keyval]
+        else:
+            return ""
+
+
 class Widget:
     def __init__(self, config, list_separator = ","):
         self.config = config
         self.list_separator = list_separator
+        self.swatches = Swatches.of(config, list_separator)
 
     def swatch_of(self, key, val, prefix = "color."):
-        if key:
-            key = prefix+key
-            value = re.sub(r"\s", "_", val)
-            keyval = f"{key}.{value}"
-            if key in self.config or keyval in self.config:
-                # key and keyval in config.
-                if   key in     self.config and keyval     in self.config:
-                    # "on" in key and not in keyval.
-                    if   "on"     in self.config[key] and "on" not in self.config[keyval]:
-                        return f"{self.config[keyval]} {self.config[key]}"
-                    # "on" not in key and in keyval.
-                    elif "on" not in self.config[key] and "on"     in self.config[keyval]:
-                        return f"{self.config[key]} {self.config[keyval]}"
-                    else: # "on" not in key and not in keyval or "on" in key and in keyval
-                        # Defaults to keyval having precedence if nothing is specified.
-                        swatch = self.config[keyval]
-                        korder = self.config["rule.precedence.color"].split(self.list_separator)
-                        for k in korder: # FIXME reverse korder?
-                            if k in keyval:
-                                swatch = self.config[keyval]
-                                break
-                            if k in key:
-                                swatch = self.config[key]
-                                break
-                        return swatch
-
-                elif key in     self.config and keyval not in self.config:
-                    return self.config[key]
-                elif key not in self.config and keyval     in self.config:
-                    return self.config[keyval]
-            else: # key and keyval not in self.config.
-                return ""
-        else: # Not key.
-            return ""
+        return self.swatches(key, val, prefix)
 
     def rtext(self, val, swatch, prefix = "color.", end="\n"):
         return rich.text.Text(val, style=self.swatch_of(swatch, val, prefix), end=end)
 
     def rdate(self, date, swatch, prefix = "color.", end="\n"):
+        return self.rtext(Dates.shared()(date), swatch, prefix, end)
+
+    def prefetch_dates(self, tasks, keys):
+        """Humanize the dates of whole columns at once."""
+        dates = Dates.shared()
+        for k in keys:
+            if k in date_fields:
+                dates.humanize([t[k] for t in tasks if k in t and type(t[k]) == str])
+
+
+date_fields = [ "due", "end", "entry", "modified", "scheduled", "start", "until", "wait"]
+
+class Dates:
+    """Humanize taskwarrior's dates, relatively to a single "now" and time zone.
+
+    The shared instance is meant to live for one rendering,
+    call `reset` to get a new "now".
+    """
+    current = None
+
+    @classmethod
+    def shared(cls):
+        if not cls.current:
+            cls.current = cls()
+        return cls.current
+
+    @classmethod
+    def reset(cls):
+        cls.current = None
+
+    def __init__(self):
         # Get current time zone from locale.
         ltz = str(datetime.datetime.now(datetime.timezone.utc).astimezone().tzinfo)
         # Ugly hack to bypass a stupid pedantry of pytz.
         fltz = ltz.replace("CEST", "Europe/Paris")
         # Get a timezone object.
-        tz = pytz.timezone(fltz)
-        # Convert data to datetime.
-        dt = datetime.datetime.strptime(date, "%Y%m%dT%H%M%SZ")
-        # convert datetime to locale datetime.
-        ldt = tz.localize(dt, is_dst = None)
-        lnow = tz.localize(datetime.datetime.now(), is_dst = None)
-        # Convert delta to human readable.
-        hd = humanize.naturaltime(lnow - ldt)
-        return self.rtext(hd, swatch, prefix, end)
+        self.tz = pytz.timezone(fltz)
+        self.lnow = self.tz.localize(datetime.datetime.now(), is_dst = None)
+        self.memo = {}
+
+    def parse(self, date):
+        # Way faster than strptime for the fixed format "%Y%m%dT%H%M%SZ".
+        if len(date) == 16 and date[8] == "T" and date[15] == "Z":
+            return datetime.datetime(int(date[0:4]), int(date[4:6]), int(date[6:8]),
+                int(date[9:11]), int(date[11:13]), int(date[13:15]))
+        else:
+            return datetime.datetime.strptime(date, "%Y%m%dT%H%M%SZ")
+
+    def humanize(self, dates):
+        """Return the human readable version of all the given dates."""
+        for date in set(dates) - self.memo.keys():
+            # convert datetime to locale datetime.
+            ldt = self.tz.localize(self.parse(date), is_dst = None)
+            # Convert delta to human readable.
+            self.memo[date] = humanize.naturaltime(self.lnow - ldt)
+        return [self.memo[date] for date in dates]
+
+    def __call__(self, date):
+        if date not in self.memo:
+            self.humanize([date])
+        return self.memo[date]
 
 
 class Tasker(Widget):
@@ -110,6 +373,73 @@ class Stacker(Widget):
             self.sorter = sorter
         else:
             self.sorter = stack.sort.Noop()
+        # Maximum number of tasks per stack, and its overrides for the stacks of a group value.
+        limit = config.get("layout.stack.limit", "")
+        self.limit = int(limit) if limit else None
+        prefix = "layout.stack.limit."
+        self.limits = {k[len(prefix):]: int(v) if v else None for k,v in config.items() if k.startswith(prefix)}
+
+    def sort(self, tasks):
+        if isinstance(tasks, GroupIndex.Node) and tasks.sorter is self.sorter:
+            # Already sorted by the index.
+            return tasks
+        return self.sorter(tasks)
+
+    def limited(self):
+        return self.limit is not None or any(v is not None for v in self.limits.values())
+
+    def limit_of(self, tasks):
+        """The limit of the stack, from its innermost group having an override."""
+        for key in reversed(getattr(tasks, "path", ())):
+            if str(key) in self.limits:
+                return self.limits[str(key)]
+        return self.limit
+
+    def select(self, tasks):
+        """The sorted tasks to display, and the number of hidden ones.
+
+        Only the top tasks of a limited stack are sorted, in O(n log limit).
+        """
+        if not isinstance(tasks, (list, GroupIndex.Node)):
+            tasks = list(tasks)
+        limit = self.limit_of(tasks)
+        if limit is None or len(tasks) <= limit:
+            return self.sort(tasks), 0
+        if isinstance(tasks, GroupIndex.Node) and tasks.sorter is self.sorter:
+            return list(itertools.islice(tasks, limit)), len(tasks) - limit
+        return self.sorter.top(tasks, limit), len(tasks) - limit
+
+    def more(self, hidden):
+        """Footer of a stack having hidden tasks."""
+        return self.rtext(f"+{hidden} more", "stack.more")
+
+    def chunks(self, tasks, chunk, limit = None):
+        """Yield the (sorted) tasks by lists of at most `chunk` tasks, `limit` tasks in total."""
+        batch = []
+        for n,task in enumerate(tasks):
+            if limit is not None and n >= limit:
+                break
+            batch.append(task)
+            if len(batch) >= chunk:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def stream(self, tasks, console, chunk = 50, limit = None):
+        """Print the stack, returns the number of printed tasks.
+
+        Stacks that can be printed progressively do so by chunks of tasks.
+        """
+        tasks, hidden = self.select(tasks)
+        tasks = list(tasks)
+        selected = len(tasks)
+        tasks = tasks[:limit]
+        console.print(self(tasks))
+        # Only when the stack was not cut by the stream limit.
+        if hidden and len(tasks) == selected:
+            console.print(self.more(hidden))
+        return len(tasks)
 
     def __call__(self, tasks):
         raise NotImplementedError
@@ -119,6 +449,16 @@ class StackSorter:
         self.field = field
         self.reverse = reverse
 
+    def key(self, task):
+        """The value on which the task is sorted, None if no sort."""
+        raise NotImplementedError
+
+    def top(self, tasks, k):
+        """The `k` first tasks, as sorted, without sorting the others."""
+        if self.reverse:
+            return heapq.nlargest(k, tasks, key = self.key)
+        return heapq.nsmallest(k, tasks, key = self.key)
+
     def __call__(self, tasks):
        raise NotImplementedError
 
@@ -137,10 +477,50 @@ class Sectioner(Widget):
             return groups.keys()
 
     def group(self, tasks):
-        if self.grouper:
-            return self.grouper(tasks)
-        else:
-            return {"":tasks}
+        if not isinstance(tasks, GroupIndex.Node):
+            # Group and sort for all the nested levels at once,
+            # unless stacks are limited, as they then only sort their top tasks.
+            sorter = None if self.leaf_stacker().limited() else self.leaf_sorter()
+            tasks = GroupIndex(tasks, self.groupers(), sorter).root
+        return tasks.children or {}
+
+    def leaf_stacker(self):
+        if isinstance(self.stacker, Sectioner):
+            return self.stacker.leaf_stacker()
+        return self.stacker
+
+    def groupers(self):
+        """The groupers of this sections and of the nested ones."""
+        grouper = self.grouper if self.grouper else Grouper(None)
+        if isinstance(self.stacker, Sectioner):
+            return [grouper] + self.stacker.groupers()
+        return [grouper]
+
+    def leaf_sorter(self):
+        if isinstance(self.stacker, Sectioner):
+            return self.stacker.leaf_sorter()
+        return getattr(self.stacker, "sorter", None)
+
+    def heading(self, key):
+        """Title and border style of the section."""
+        raise NotImplementedError
+
+    def stream(self, tasks, console, chunk = 50, limit = None):
+        """Print sections one after the other, streaming their stacks.
+
+        Returns the number of printed tasks.
+        """
+        printed = 0
+        groups = self.group(tasks)
+        for key in self.order(groups):
+            if key in groups:
+                if limit is not None and printed >= limit:
+                    break
+                title, style = self.heading(key)
+                console.rule(title, style = style, align = "left")
+                printed += self.stacker.stream(groups[key], console, chunk,
+                    None if limit is None else limit - printed)
+        return printed
 
     def __call__(self, tasks):
         raise NotImplementedError
@@ -160,9 +540,9 @@ class task:
 
             sid = str(task["id"])
             if ":" in task["description"]:
-                short, desc = task["description"].split(":")
+                short, desc = task["description"].split(":", 1)
                 title = self.rtext(sid, "id") + rich.text.Text(":", style="default") + self.rtext(short.strip(), "description.short")
-                desc = rtext("\n".join(textwrap.wrap(desc.strip(), self.wrap_width)), "description.long")
+                desc = self.rtext("\n".join(textwrap.wrap(desc.strip(), self.wrap_width)), "description.long")
             elif len(task["description"]) <= self.wrap_width - 8:
                 d = task["description"].strip()
                 title = self.rtext(sid, "id") + rich.text.Text(":", style="default") + self.rtext(d, "description.short")
@@ -267,6 +647,12 @@ class stack:
             def __init__(self):
                 super().__init__(None)
 
+            def key(self, task):
+                return None
+
+            def top(self, tasks, k):
+                return list(itertools.islice(tasks, k))
+
             def __call__(self, tasks):
                 return tasks
 
@@ -274,98 +660,143 @@ class stack:
             def __init__(self, field, reverse = False):
                 super().__init__(field, reverse)
 
+            def key(self, task):
+                if self.field in task:
+                    return task[self.field]
+                else:
+                    return "XXX" # No field comes last.
+
             def __call__(self, tasks):
-                def field_or_not(task):
-                    if self.field in task:
-                        return task[self.field]
-                    else:
-                        return "XXX" # No field comes last.
-                return sorted(tasks, key = field_or_not, reverse = self.reverse)
+                return sorted(tasks, key = self.key, reverse = self.reverse)
 
         class Priority(StackSorter):
+            p_values = {"H": 0, "M": 1, "L": 2, "": 3}
+
             def __init__(self, reverse = False):
                 super().__init__("priority", reverse)
 
+            def key(self, task):
+                if self.field in task:
+                    return self.p_values[task[self.field]]
+                else:
+                    return self.p_values[""]
+
             def __call__(self, tasks):
-                def p_value(task):
-                    p_values = {"H": 0, "M": 1, "L": 2, "": 3}
-                    if self.field in task:
-                        return p_values[task[self.field]]
-                    else:
-                        return p_values[""]
-                return sorted(tasks, key = p_value, reverse = self.reverse)
+                return sorted(tasks, key = self.key, reverse = self.reverse)
 
     class RawTable(Stacker):
         def __init__(self, config, tasker, sorter = None):
             super().__init__(config, tasker, sorter = sorter)
             self.tag_icons = [ self.config["icon.tag.before"], self.config["icon.tag.after"] ]
 
-        def __call__(self, tasks):
-            keys = self.tasker.show_only
-
+        def table(self, widths = None):
             table = rich.table.Table(box = None, show_header = False, show_lines = True, expand = True, row_styles=["color.row.odd", "color.row.even"])
-            table.add_column("H")
-            for k in keys:
-                table.add_column(k)
-
-            for task in self.sorter(tasks):
-                taskers = self.tasker(task)
-                if str(task["id"]) in self.tasker.touched:
-                    row = [self.rtext("▶", "touched")]
+            table.add_column("H", width = 1 if widths is not None else None)
+            for k in self.tasker.show_only:
+                if widths is not None and k not in widths:
+                    # Takes all the remaining space.
+                    table.add_column(k, ratio = 1)
                 else:
-                    row = [""]
+                    table.add_column(k, width = widths.get(k) if widths else None)
+            return table
 
-                for k in keys:
-                    if k in task:
-                        val = taskers[k]
-                        ##### String keys #####
-                        if type(val) == str:
-                            # Description is a special case.
-                            if k == "description" and ":" in val:
-                                # Split description in "short: long".
-                                vals = val.split(":")
-                                short, desc = vals[0], ":".join(vals[1:])
-                                # FIXME groups add a newline or hide what follows, no option to avoid it.
-                                # row.append( rich.console.Group(
-                                #     rich.text.Text(short+":", style="color.description.short", end="\n"),
-                                #     rich.text.Text(desc, style="color.description", end="\n")
-                                # ))
-                                # FIXME style leaks on all texts:
-                                # (Note that "default" is a special color for Rich.)
-                                row.append( self.rtext(short, "description.short", end="") + \
-                                            rich.text.Text(":", style="default", end="") + \
-                                            self.rtext(desc, "description.long", end="") )
-
-                            elif k in [ "due", "end", "entry", "modified", "scheduled", "start", "until", "wait"]:
-                                row.append( self.rdate(val, k) )
-
-                            # Strings, but not description.
-                            else:
-                                row.append( self.rtext(val, k) )
-                        ##### List keys. #####
-                        elif type(val) == list:
-                            # Tags are a special case.
-                            if k == "tags":
-                                tags = rich.text.Text("")
-                                for t in val:
-                                    # FIXME use Columns if/when it does not expand.
-                                    tags += \
-                                        self.rtext(self.tag_icons[0], "tags.ends") + \
-                                        self.rtext(t, k) + \
-                                        self.rtext(self.tag_icons[1], "tags.ends") + \
-                                        " "
-                                row.append( tags )
-                            # List, but not tags.
-                            else:
-                                row.append( self.rtext(" ".join(val), k) )
-                        ##### Other type of keys. #####
+        def row(self, task):
+            keys = self.tasker.show_only
+            taskers = self.tasker(task)
+            if str(task["id"]) in self.tasker.touched:
+                row = [self.rtext("▶", "touched")]
+            else:
+                row = [""]
+
+            for k in keys:
+                if k in task:
+                    val = taskers[k]
+                    ##### String keys #####
+                    if type(val) == str:
+                        # Description is a special case.
+                        if k == "description" and ":" in val:
+                            # Split description in "short: long".
+                            vals = val.split(":")
+                            short, desc = vals[0], ":".join(vals[1:])
+                            # FIXME groups add a newline or hide what follows, no option to avoid it.
+                            # row.append( rich.console.Group(
+                            #     rich.text.Text(short+":", style="color.description.short", end="\n"),
+                            #     rich.text.Text(desc, style="color.description", end="\n")
+                            # ))
+                            # FIXME style leaks on all texts:
+                            # (Note that "default" is a special color for Rich.)
+                            row.append( self.rtext(short, "description.short", end="") + \
+                                        rich.text.Text(":", style="default", end="") + \
+                                        self.rtext(desc, "description.long", end="") )
+
+                        elif k in [ "due", "end", "entry", "modified", "scheduled", "start", "until", "wait"]:
+                            row.append( self.rdate(val, k) )
+
+                        # Strings, but not description.
+                        else:
+                            row.append( self.rtext(val, k) )
+                    ##### List keys. #####
+                    elif type(val) == list:
+                        # Tags are a special case.
+                        if k == "tags":
+                            tags = rich.text.Text("")
+                            for t in val:
+                                # FIXME use Columns if/when it does not expand.
+                                tags += \
+                                    self.rtext(self.tag_icons[0], "tags.ends") + \
+                                    self.rtext(t, k) + \
+                                    self.rtext(self.tag_icons[1], "tags.ends") + \
+                                    " "
+                            row.append( tags )
+                        # List, but not tags.
                         else:
-                            row.append( self.rtext(str(val), k) )
+                            row.append( self.rtext(" ".join(val), k) )
+                    ##### Other type of keys. #####
                     else:
-                        row.append("")
-                table.add_row(*[t for t in row])
+                        row.append( self.rtext(str(val), k) )
+                else:
+                    row.append("")
+            return row
+
+        def __call__(self, tasks):
+            keys = self.tasker.show_only
+            table = self.table()
+            tasks, hidden = self.select(tasks)
+            self.prefetch_dates(tasks, keys)
+            for task in tasks:
+                table.add_row(*self.row(task))
+            if hidden:
+                table.caption = self.more(hidden)
+                table.caption_justify = "left"
             return table
 
+        def stream(self, tasks, console, chunk = 50, limit = None):
+            keys = self.tasker.show_only
+            # Keep the alternance of row styles across chunks.
+            chunk += chunk % 2
+            widths = None
+            printed = 0
+            tasks, hidden = self.select(tasks)
+            for batch in self.chunks(tasks, chunk, limit):
+                self.prefetch_dates(batch, keys)
+                rows = [self.row(task) for task in batch]
+                if widths is None:
+                    # Fix the width of all the columns on the first chunk,
+                    # except for the description, which takes the remaining space.
+                    widths = {}
+                    for i,k in enumerate(keys):
+                        if k != "description":
+                            widths[k] = max(1, *(rich.text.Text(r[i+1]).cell_len if type(r[i+1]) == str else r[i+1].cell_len for r in rows))
+                table = self.table(widths)
+                for row in rows:
+                    table.add_row(*row)
+                console.print(table)
+                console.file.flush()
+                printed += len(batch)
+            if hidden and printed == len(tasks):
+                console.print(self.more(hidden))
+            return printed
+
 
     class Vertical(Stacker):
         def __init__(self, config, tasker, sorter = None):
@@ -374,18 +805,37 @@ class stack:
         def __call__(self, tasks):
             stack = rich.table.Table(box = None, show_header = False, show_lines = False, expand = True)
             stack.add_column("Tasks")
-            for task in self.sorter(tasks):
+            tasks, hidden = self.select(tasks)
+            self.prefetch_dates(tasks, self.tasker.show_only or date_fields)
+            for task in tasks:
                stack.add_row( self.tasker(task) )
+            if hidden:
+                stack.add_row( self.more(hidden) )
             return stack
 
+        def stream(self, tasks, console, chunk = 50, limit = None):
+            printed = 0
+            tasks, hidden = self.select(tasks)
+            for batch in self.chunks(tasks, chunk, limit):
+                console.print(self(batch))
+                console.file.flush()
+                printed += len(batch)
+            if hidden and printed == len(tasks):
+                console.print(self.more(hidden))
+            return printed
+
     class Flat(Stacker):
         def __init__(self, config, tasker, sorter = None):
             super().__init__(config, tasker, sorter = sorter)
 
         def __call__(self, tasks):
             stack = []
-            for task in self.sorter(tasks):
+            tasks, hidden = self.select(tasks)
+            self.prefetch_dates(tasks, self.tasker.show_only or date_fields)
+            for task in tasks:
                stack.append( self.tasker(task) )
+            if hidden:
+                stack.append( self.more(hidden) )
             cols = rich.columns.Columns(stack)
             return cols
 
@@ -394,40 +844,257 @@ class sections:
         def __init__(self, config, stacker, order, group):
             super().__init__(config, stacker, order, group)
 
+        def heading(self, key):
+            if self.grouper.field:
+                swatch = f"{self.grouper.field}.{key}"
+            else:
+                swatch = key
+            val = str(key).upper()
+            return self.rtext(val, swatch), self.swatch_of(swatch, val)
+
         def __call__(self, tasks):
             sections = []
             groups = self.group(tasks)
+            keys = [k for k in self.order(groups) if k in groups]
+            if render_pool.wanted(tasks, keys):
+                return Panels(self, groups, keys)
             for key in self.order(groups):
                 if key in groups:
-                    if self.grouper.field:
-                        swatch = f"{self.grouper.field}.{key}"
-                    else:
-                        swatch = key
-                    val = str(key).upper()
-                    sections.append( rich.panel.Panel(self.stacker(groups[key]), title = self.rtext(val, swatch), title_align = "left", expand = True, border_style = self.swatch_of(swatch, val)))
+                    title, style = self.heading(key)
+                    sections.append( rich.panel.Panel(self.stacker(groups[key]), title = title, title_align = "left", expand = True, border_style = style))
             return rich.console.Group(*sections)
 
     class Horizontal(Sectioner):
         def __init__(self, config, stacker, order, group):
             super().__init__(config, stacker, order, group)
 
-        def __call__(self, tasks):
-            sections = []
-            groups = self.group(tasks)
+        def heading(self, key):
+            return self.rtext(key.upper(), key), "color.title"
+
+        def table(self, keys, stacks):
             table = rich.table.Table(box = None, show_header = False, show_lines = False)
-            keys = []
-            for key in self.order(groups):
-                if key in groups:
-                    table.add_column(key)
-                    keys.append(key)
+            for key in keys:
+                table.add_column(key)
 
             row = []
-            for k in keys:
-                row.append( rich.panel.Panel(self.stacker(groups[k]), title = self.rtext(k.upper(), k), title_align = "left", expand = True, border_style="color.title"))
+            for k,stack in zip(keys, stacks):
+                title, style = self.heading(k)
+                row.append( rich.panel.Panel(stack, title = title, title_align = "left", expand = True, border_style = style))
 
             table.add_row(*row)
             return table
 
+        def __call__(self, tasks):
+            groups = self.group(tasks)
+            keys = [k for k in self.order(groups) if k in groups]
+            if render_pool.wanted(tasks, keys):
+                return ColumnsLayout(self, groups, keys, parallel = True)
+            return self.table(keys, [self.stacker(groups[k]) for k in keys])
+
+    class Kanban(Horizontal):
+        """Same display than Horizontal, without letting Rich measure nested tables.
+
+        Each stack is measured once, Rich lays the table out from these measures,
+        then each stack is rendered once, at the width of its column.
+        """
+        def __init__(self, config, stacker, order, group):
+            super().__init__(config, stacker, order, group)
+
+        def __call__(self, tasks):
+            groups = self.group(tasks)
+            keys = [k for k in self.order(groups) if k in groups]
+            return ColumnsLayout(self, groups, keys, parallel = render_pool.wanted(tasks, keys))
+
+
+class Rendered:
+    """Lines of segments that are already rendered."""
+    def __init__(self, lines, width):
+        self.lines = lines
+        self.width = width
+
+    def __rich_console__(self, console, options):
+        for line in self.lines:
+            yield from line
+            yield rich.segment.Segment.line()
+
+    def __rich_measure__(self, console, options):
+        return rich.measure.Measurement(self.width, self.width)
+
+
+class Panels:
+    """Sections of a Vertical layout, their stacks being rendered by the worker processes."""
+    def __init__(self, sectioner, groups, keys):
+        self.sectioner = sectioner
+        self.groups = groups
+        self.keys = keys
+
+    def __rich_console__(self, console, options):
+        # Panels borders and padding.
+        inner = max(1, options.max_width - 4)
+        done = render_pool.render([(self.sectioner.stacker, self.groups[k], inner, None) for k in self.keys], options)
+        for k,(_,_,lines) in zip(self.keys, done):
+            title, style = self.sectioner.heading(k)
+            yield rich.panel.Panel(Rendered(lines, inner), title = title, title_align = "left", expand = True, border_style = style)
+
+
+class Deferred:
+    """Stack rendered apart, standing for it in a Rich layout.
+
+    It is first measured, then rendered once to know the width that
+    Rich gives to it, and only then are its lines rendered.
+    """
+    def __init__(self, stacker, tasks, measure):
+        self.stacker = stacker
+        self.tasks = tasks
+        self.measure = measure
+        self.width = None
+        self.lines = None
+
+    def __rich_console__(self, console, options):
+        if self.lines is None:
+            self.width = options.max_width
+            return
+        if options.max_width == self.width:
+            lines = self.lines
+        else:
+            lines = console.render_lines(self.stacker(self.tasks), options, pad = True)
+        for line in lines:
+            yield from line
+            yield rich.segment.Segment.line()
+
+    def __rich_measure__(self, console, options):
+        return self.measure
+
+
+class ColumnsLayout:
+    """Sections of a Horizontal layout, their stacks being measured then rendered once.
+
+    In `parallel`, the stacks are measured and rendered by the worker processes.
+    """
+    def __init__(self, sectioner, groups, keys, parallel = False):
+        self.sectioner = sectioner
+        self.groups = groups
+        self.keys = keys
+        self.parallel = parallel
+
+    def __rich_console__(self, console, options):
+        stacker = self.sectioner.stacker
+        # Panels measure their content without their borders and padding.
+        inner = options.update_width(max(1, options.max_width - 4))
+        if self.parallel:
+            measured = [m for m,_,_ in render_pool.render([(stacker, self.groups[k], None, None) for k in self.keys], inner)]
+        else:
+            made = [stacker(self.groups[k]) for k in self.keys]
+            measured = [rich.measure.Measurement.get(console, inner, stack) for stack in made]
+        stacks = [Deferred(stacker, self.groups[k], measure) for k,measure in zip(self.keys, measured)]
+        table = self.sectioner.table(self.keys, stacks)
+        # Let Rich lay the table out, to know the width of each stack.
+        console.render_lines(table, options)
+        if self.parallel:
+            done = render_pool.render([(stacker, self.groups[k], max(1, s.width or 1), None) for k,s in zip(self.keys, stacks)], options)
+            for stack,(_,_,lines) in zip(stacks, done):
+                stack.lines = lines
+        else:
+            for stack,made in zip(stacks, made):
+                stack.lines = console.render_lines(made, options.update(width = max(1, stack.width or 1)), pad = True)
+        yield table
+
+
+class RenderPool:
+    """Worker processes rendering the stacks of independent sections.
+
+    The stacks are split in one batch per worker, balanced on their number of tasks:
+    largest first, each to the least loaded batch. Only whole boards of at least
+    `min_tasks` tasks are rendered this way, as starting the workers costs more
+    than rendering small ones.
+    """
+    def __init__(self):
+        self.jobs = 0
+        self.min_tasks = 1000
+        self.pool = None
+
+    def configure(self, config):
+        jobs = config["layout.parallel.jobs"]
+        self.jobs = (os.cpu_count() or 1) if jobs == "auto" else int(jobs)
+        self.min_tasks = int(config["layout.parallel.min"])
+
+    def wanted(self, tasks, keys):
+        # Nested sections are given the nodes of their group.
+        return self.jobs > 1 and len(keys) > 1 and isinstance(tasks, list) and len(tasks) >= self.min_tasks
+
+    @staticmethod
+    def batches(sizes, n):
+        """Indices of the jobs of each of the `n` batches, with the largest jobs first."""
+        loads = [(0, b) for b in range(n)]
+        batches = [[] for b in range(n)]
+        for i in sorted(range(len(sizes)), key = sizes.__getitem__, reverse = True):
+            load, b = heapq.heappop(loads)
+            batches[b].append(i)
+            heapq.heappush(loads, (load + sizes[i], b))
+        return [b for b in batches if b]
+
+    def executor(self):
+        if self.pool is None:
+            self.pool = concurrent.futures.ProcessPoolExecutor(max_workers = self.jobs, initializer = render_worker)
+        return self.pool
+
+    def render(self, jobs, options):
+        """Results of render_stacks for each (stacker, tasks, width, cap) job, in order."""
+        if self.jobs < 2:
+            # The pool failed on a previous part of the board.
+            return render_stacks(jobs, options)
+        # Nodes hold all the tasks of the board, only send their own.
+        jobs = [(s, t.detach() if isinstance(t, GroupIndex.Node) else t, w, c) for s,t,w,c in jobs]
+        batches = self.batches([len(t) for _,t,_,_ in jobs], self.jobs)
+        results = [None] * len(jobs)
+        try:
+            futures = [self.executor().submit(render_stacks, [jobs[i] for i in b], options) for b in batches]
+            for b,future in zip(batches, futures):
+                for i,result in zip(b, future.result()):
+                    results[i] = result
+        # Objects that cannot be pickled mostly raise TypeError or AttributeError.
+        except (OSError, TypeError, AttributeError, pickle.PicklingError, concurrent.futures.process.BrokenProcessPool) as exc:
+            logging.warning(f"Rendering sections in this process only: {exc!r}")
+            self.jobs = 0
+            self.pool = None
+            return render_stacks(jobs, options)
+        return results
+
+render_pool = RenderPool()
+
+
+def render_worker():
+    # Sections are not split again in the workers.
+    render_pool.jobs = 0
+
+
+def render_stacks(jobs, options):
+    """Render stacks as lines of segments, in a worker process.
+
+    Each job is (stacker, tasks, width, cap), stacks without width being
+    rendered at their maximum width, up to `cap`, or only measured without cap.
+    Returns (measurement or None, width, lines or None) for each job.
+    """
+    consoles = {}
+    results = []
+    for stacker, tasks, width, cap in jobs:
+        if id(stacker.config) not in consoles:
+            consoles[id(stacker.config)] = rich.console.Console(theme = rich.theme.Theme(get_swatch(stacker.config)),
+                file = io.StringIO(), width = options.max_width, legacy_windows = options.legacy_windows,
+                force_terminal = options.is_terminal)
+        console = consoles[id(stacker.config)]
+        stack = stacker(tasks)
+        measure = None
+        if width is None:
+            measure = rich.measure.Measurement.get(console, options, stack)
+            if cap is None:
+                results.append( (measure, None, None) )
+                continue
+            width = max(1, min(measure.maximum, cap))
+        results.append( (measure, width, console.render_lines(stack, options.update(width = width), pad = True)) )
+    return results
+
+
 class SectionSorter:
     def __call__(self):
         raise NotImplementedError
@@ -437,21 +1104,92 @@ class Grouper:
     def __init__(self, field):
         self.field = field
 
+    def key(self, task):
+        """The group of the task, None if it does not belong to any."""
+        if self.field is None:
+            return ""
+        return task.get(self.field, "")
+
     def __call__(self, tasks):
         groups = {}
         for task in tasks:
-            if self.field in task:
-                if task[self.field] in groups:
-                    groups[ task[self.field] ].append(task)
-                else:
-                    groups[ task[self.field] ] = [task]
-            else:
-                if "" in groups:
-                    groups[ "" ].append( task )
+            k = self.key(task)
+            if k is not None:
+                if k in groups:
+                    groups[k].append(task)
                 else:
-                    groups[ "" ] = [task]
+                    groups[k] = [task]
         return groups
 
+
+class GroupIndex:
+    """Tasks grouped on several levels and sorted, in a single pass.
+
+    Each level is a grouper, leaves are sorted with the given sorter.
+    Nodes hold arrays of indices in the tasks list, not copies of the tasks.
+    """
+    class Node:
+        def __init__(self, tasks, sorter = None, path = ()):
+            self.all = tasks
+            self.indices = array.array("L")
+            self.children = None
+            self.sorter = sorter
+            # Keys of the groups from the root to this node.
+            self.path = path
+
+        def __iter__(self):
+            for i in self.indices:
+                yield self.all[i]
+
+        def __len__(self):
+            return len(self.indices)
+
+        def detach(self):
+            """Copy of the node and of its children, only holding their own tasks."""
+            tasks = list(self)
+            where = {i: n for n,i in enumerate(self.indices)}
+            def copy(node):
+                new = GroupIndex.Node(tasks, node.sorter, node.path)
+                new.indices = array.array("L", [where[i] for i in node.indices])
+                if node.children is not None:
+                    new.children = {k: copy(c) for k,c in node.children.items()}
+                return new
+            return copy(self)
+
+    def __init__(self, tasks, groupers, sorter = None):
+        self.tasks = tasks if isinstance(tasks, list) else list(tasks)
+        self.root = self.Node(self.tasks)
+
+        # Create the nodes in the order in which groups appear.
+        paths = []
+        for task in self.tasks:
+            node = self.root
+            path = [node]
+            for grouper in groupers:
+                k = grouper.key(task)
+                if k is None:
+                    path = None
+                    break
+                if node.children is None:
+                    node.children = {}
+                if k not in node.children:
+                    node.children[k] = self.Node(self.tasks, path = node.path + (k,))
+                node = node.children[k]
+                path.append(node)
+            paths.append(path)
+
+        # Precompute sort keys and sort all tasks at once,
+        # leaves being filled in that order are sorted as well.
+        order = range(len(self.tasks))
+        if sorter and not isinstance(sorter, stack.sort.Noop):
+            keys = [sorter.key(task) for task in self.tasks]
+            order = sorted(order, key = keys.__getitem__, reverse = sorter.reverse)
+        for i in order:
+            if paths[i]:
+                for node in paths[i]:
+                    node.indices.append(i)
+                paths[i][-1].sorter = sorter
+
 class group:
     class sort:
         class OnValues(SectionSorter):
@@ -472,24 +1210,411 @@ class group:
         def __init__(self):
             super().__init__("status")
 
-        def __call__(self, tasks):
-            groups = {}
+        def key(self, task):
+            if "start" in task:
+                return "started"
+            return task.get(self.field)
+
+    class Repo(Grouper):
+        """Group tasks by the database they were exported from.
+
+        Tasks are not modified (they may be shared with the store),
+        their database is looked up by identity.
+        """
+        def __init__(self):
+            super().__init__("repo")
+            self.repos = {}
+
+        def add(self, name, tasks):
             for task in tasks:
-                if "start" in task:
-                    if "started" in groups:
-                        groups["started"].append(task)
-                    else:
-                        groups["started"] = [task]
-                elif self.field in task:
-                    if task[self.field] in groups:
-                        groups[ task[self.field] ].append(task)
-                    else:
-                        groups[ task[self.field] ] = [task]
+                self.repos[id(task)] = name
+
+        def key(self, task):
+            return self.repos.get(id(task))
+
+
+def board_stacks(sectioner, tasks, path = (), limited = True):
+    """Yield the group keys, the sorted tasks and the number of hidden tasks of each stack, in display order.
+
+    Walks the same sections and stacks than the widgets, without making any.
+    Stacks hold all their tasks if not `limited`.
+    """
+    if isinstance(sectioner, Sectioner):
+        groups = sectioner.group(tasks)
+        for key in sectioner.order(groups):
+            if key in groups:
+                yield from board_stacks(sectioner.stacker, groups[key], path + (key,), limited)
+    elif limited:
+        tasks, hidden = sectioner.select(tasks)
+        yield path, tasks, hidden
+    else:
+        yield path, sectioner.sort(tasks), 0
+
+
+class output:
+    """Writers of the tasks for other programs, one stack at a time."""
+    class Writer:
+        # Data formats hold all the tasks, whatever the limits of the stacks.
+        limited = False
+
+        def __init__(self, file, groups, columns):
+            self.file = file
+            # Field of each section level, and displayed fields.
+            self.groups = groups
+            self.columns = columns
+
+        def stack(self, path, tasks, hidden):
+            raise NotImplementedError
+
+        def close(self):
+            pass
+
+        @staticmethod
+        def text(value):
+            if type(value) == list:
+                return ",".join(str(v) for v in value)
+            return "" if value is None else str(value)
+
+    class JSON(Writer):
+        """One JSON object per line and per task, with the displayed fields and the groups of the task."""
+        def stack(self, path, tasks, hidden):
+            groups = dict(zip(self.groups, path))
+            for task in tasks:
+                line = dict(groups)
+                for k in self.columns:
+                    if k in task:
+                        line[k] = task[k]
+                self.file.write(json.dumps(line) + "\n")
+
+    class CSV(Writer):
+        delimiter = ","
+
+        def __init__(self, file, groups, columns):
+            super().__init__(file, groups, columns)
+            self.writer = csv.writer(file, delimiter = self.delimiter, lineterminator = "\n")
+            self.writer.writerow(self.groups + self.columns)
+
+        def stack(self, path, tasks, hidden):
+            for task in tasks:
+                self.writer.writerow(list(path) + [self.text(task.get(k)) for k in self.columns])
+
+    class TSV(Writer):
+        """Tab-separated values, without quoting: tabs and newlines in values are replaced by spaces."""
+        def __init__(self, file, groups, columns):
+            super().__init__(file, groups, columns)
+            self.row(self.groups + self.columns)
+
+        def row(self, values):
+            self.file.write("\t".join(re.sub(r"[\t\n\r]", " ", v) for v in values) + "\n")
+
+        def stack(self, path, tasks, hidden):
+            for task in tasks:
+                self.row([self.text(k) for k in path] + [self.text(task.get(k)) for k in self.columns])
+
+    class HTML(Writer):
+        """A static page, with a heading per section and a table per stack."""
+        limited = True
+
+        def __init__(self, file, groups, columns):
+            super().__init__(file, groups, columns)
+            self.path = ()
+            self.file.write('<!DOCTYPE html>\n<html>\n<head><meta charset="utf-8"><title>Tasks</title></head>\n<body>\n')
+
+        def stack(self, path, tasks, hidden):
+            escape = html.escape
+            # Headings of the sections that were not opened by the previous stack.
+            same = 0
+            while same < min(len(path), len(self.path)) and path[same] == self.path[same]:
+                same += 1
+            for level in range(same, len(path)):
+                n = min(level + 1, 6)
+                self.file.write(f'<h{n} class="{escape(self.groups[level])}">{escape(self.text(path[level]))}</h{n}>\n')
+            self.path = path
+            self.file.write("<table>\n<tr>" + "".join(f"<th>{escape(k)}</th>" for k in self.columns) + "</tr>\n")
+            for task in tasks:
+                self.file.write("<tr>" + "".join(f"<td>{escape(self.text(task.get(k)))}</td>" for k in self.columns) + "</tr>\n")
+            if hidden:
+                self.file.write(f'<tr><td colspan="{len(self.columns)}">+{hidden} more</td></tr>\n')
+            self.file.write("</table>\n")
+
+        def close(self):
+            self.file.write("</body>\n</html>\n")
+
+    formats = {"json": JSON, "csv": CSV, "tsv": TSV, "html": HTML}
+
+
+def output_format(options, config, file = None):
+    """The format asked by `--format` or `output.format`, `auto` meaning `rich` on a terminal, `json` otherwise."""
+    format = options.get("format") or config["output.format"]
+    if format == "auto":
+        file = file or sys.stdout
+        format = "rich" if file.isatty() else "json"
+    if format != "rich" and format not in output.formats:
+        error("UNKNOWN_FORMAT", f"Unknown output format `{format}`, use one of: rich, {', '.join(output.formats)}.")
+    return format
+
+
+def write_board(format, sectioner, tasks, file = None):
+    """Write the tasks in a format for other programs, following the sections and stacks of the board."""
+    file = file or sys.stdout
+    groups = []
+    leaf = sectioner
+    while isinstance(leaf, Sectioner):
+        groups.append(leaf.grouper.field if leaf.grouper and leaf.grouper.field else "group")
+        leaf = leaf.stacker
+    columns = [k for k in leaf.tasker.show_only or [] if k not in groups]
+    try:
+        writer = output.formats[format](file, groups, columns)
+        for path, stack_tasks, hidden in board_stacks(sectioner, tasks, limited = writer.limited):
+            writer.stack(path, stack_tasks, hidden)
+        writer.close()
+        file.flush()
+    except BrokenPipeError:
+        # The reader did not want more (e.g. `head`), do not fail again when exiting.
+        try:
+            os.dup2(os.open(os.devnull, os.O_WRONLY), file.fileno())
+        except OSError:
+            pass
+    return 0
+
+
+class UnsupportedFilter(Exception):
+    """The filter uses a part of taskwarrior's grammar that Filter does not know."""
+    pass
+
+class Filter:
+    """Evaluate a taskwarrior filter on exported tasks, without calling taskwarrior.
+
+    Handles the common grammar: IDs and UUIDs lists, +tag/-tag,
+    `attribute[.modifier]:value`, bare description patterns,
+    and/or/xor and parentheses.
+    Raises UnsupportedFilter for anything else (dates, regexps, operators, most virtual tags…),
+    in which case one should ask taskwarrior.
+    """
+    virtual_tags = {
+        "PENDING"  : lambda t: t.get("status") == "pending",
+        "COMPLETED": lambda t: t.get("status") == "completed",
+        "DELETED"  : lambda t: t.get("status") == "deleted",
+        "WAITING"  : lambda t: t.get("status") == "waiting",
+        "ACTIVE"   : lambda t: "start" in t,
+        "TAGGED"   : lambda t: bool(t.get("tags")),
+        "ANNOTATED": lambda t: bool(t.get("annotations")),
+        "PROJECT"  : lambda t: "project" in t,
+        "PRIORITY" : lambda t: "priority" in t,
+    }
+    # Attributes holding dates, which would need taskwarrior's date parser.
+    dates = ["due", "end", "entry", "modified", "scheduled", "start", "until", "wait"]
+    numbers = ["id", "urgency"]
+    strings = ["status", "project", "priority", "description", "uuid", "parent", "recur"]
+    regexp_chars = set(".*+?[](){}|^$\\")
+    # Attributes matching a whole level of a hierarchy, rather than any prefix.
+    hierarchies = ["project"]
+
+    # Fields used by the virtual tags.
+    virtual_fields = {
+        "PENDING": "status", "COMPLETED": "status", "DELETED": "status", "WAITING": "status",
+        "ACTIVE": "start", "TAGGED": "tags", "ANNOTATED": "annotations", "PROJECT": "project", "PRIORITY": "priority",
+    }
 
-            return groups
+    def __init__(self, words):
+        self.tokens = self.tokenize(words)
+        self.pos = 0
+        # Fields of the tasks on which the filter depends.
+        self.fields = set()
+        if self.tokens:
+            self.predicate = self.parse_or()
+            if self.pos != len(self.tokens):
+                raise UnsupportedFilter(f"unexpected `{self.tokens[self.pos]}`")
+        else:
+            self.predicate = lambda t: True
 
+    def __call__(self, tasks):
+        return [t for t in tasks if self.predicate(t)]
+
+    def tokenize(self, words):
+        tokens = []
+        for word in " ".join(words).split():
+            if word.startswith("rc.") or word.startswith("rc:"):
+                continue # Configuration overrides are not filters.
+            while word.startswith("("):
+                tokens.append("(")
+                word = word[1:]
+            closing = 0
+            while word.endswith(")") and word.count("(") < word.count(")"):
+                closing += 1
+                word = word[:-1]
+            if word:
+                tokens.append(word)
+            tokens += [")"] * closing
+        return tokens
+
+    def peek(self):
+        if self.pos < len(self.tokens):
+            return self.tokens[self.pos]
+        return None
 
-def call_taskwarrior(args:list[str] = ["export"], taskfile = ".task") -> str:
+    def parse_or(self):
+        left = self.parse_xor()
+        while self.peek() == "or":
+            self.pos += 1
+            l, r = left, self.parse_xor()
+            left = lambda t, l=l, r=r: l(t) or r(t)
+        return left
+
+    def parse_xor(self):
+        left = self.parse_and()
+        while self.peek() == "xor":
+            self.pos += 1
+            l, r = left, self.parse_and()
+            left = lambda t, l=l, r=r: l(t) != r(t)
+        return left
+
+    def parse_and(self):
+        left = self.parse_term()
+        # Terms are implicitly joined by `and`.
+        while self.peek() not in [None, "or", "xor", ")"]:
+            if self.peek() == "and":
+                self.pos += 1
+            l, r = left, self.parse_term()
+            left = lambda t, l=l, r=r: l(t) and r(t)
+        return left
+
+    def parse_term(self):
+        word = self.peek()
+        if word is None or word in ["and", "or", "xor", ")"]:
+            raise UnsupportedFilter(f"missing term before `{word}`")
+        self.pos += 1
+
+        if word == "(":
+            pred = self.parse_or()
+            if self.peek() != ")":
+                raise UnsupportedFilter("unbalanced parenthesis")
+            self.pos += 1
+            return pred
+
+        ids, uuids = self.as_ids(word)
+        if ids is not None:
+            # Consecutive IDs/UUIDs are joined by `or`.
+            while self.peek() is not None:
+                more = self.as_ids(self.peek())
+                if more[0] is None:
+                    break
+                ids |= more[0]
+                uuids += more[1]
+                self.pos += 1
+            self.fields |= {"id", "uuid"}
+            return lambda t: t.get("id") in ids or any(t.get("uuid","").startswith(u) for u in uuids)
+
+        if word[0] in "+-" and len(word) > 1:
+            tag = word[1:]
+            if tag.isupper():
+                if tag not in self.virtual_tags:
+                    raise UnsupportedFilter(f"virtual tag `{word}`")
+                has = self.virtual_tags[tag]
+                self.fields.add(self.virtual_fields[tag])
+            else:
+                has = lambda t: tag in t.get("tags", [])
+                self.fields.add("tags")
+            if word[0] == "+":
+                return has
+            else:
+                return lambda t: not has(t)
+
+        m = re.fullmatch(r"([a-z_][\w\-]*)(?:\.([a-z]+))?:(.*)", word)
+        if m:
+            return self.attribute(*m.groups())
+
+        if set("<>=!~") & set(word):
+            raise UnsupportedFilter(f"operator in `{word}`")
+
+        # Bare word: search pattern on description and annotations.
+        if word.startswith("/") and word.endswith("/") and len(word) > 1:
+            word = word[1:-1]
+        if self.regexp_chars & set(word):
+            raise UnsupportedFilter(f"regular expression `{word}`")
+        self.fields |= {"description", "annotations"}
+        return lambda t: word in t.get("description", "") \
+            or any(word in a.get("description", "") for a in t.get("annotations", []))
+
+    @staticmethod
+    def as_ids(word):
+        """Return the set of IDs and the list of UUIDs in `word`, or (None, None)."""
+        ids = set()
+        uuids = []
+        for part in word.split(","):
+            if re.fullmatch(r"[0-9]+", part):
+                ids.add(int(part))
+            elif re.fullmatch(r"[0-9]+-[0-9]+", part):
+                a, b = part.split("-")
+                ids.update(range(int(a), int(b)+1))
+            elif re.fullmatch(r"[0-9a-f]{8}(?:-[0-9a-f]{4}){0,3}(?:-[0-9a-f]{12})?", part):
+                uuids.append(part)
+            else:
+                return None, None
+        return ids, uuids
+
+    def attribute(self, name, modifier, value):
+        if name in self.dates:
+            raise UnsupportedFilter(f"date attribute `{name}`")
+        if name not in self.strings + self.numbers + ["tags", "tag"]:
+            raise UnsupportedFilter(f"unknown attribute `{name}`")
+        self.fields.add("tags" if name == "tag" else name)
+        if name == "tags" or name == "tag":
+            if modifier in [None, "has", "contains", "is", "equals"]:
+                return lambda t: value in t.get("tags", [])
+            elif modifier in ["hasnt", "not", "isnt"]:
+                return lambda t: value not in t.get("tags", [])
+            elif modifier == "none":
+                return lambda t: not t.get("tags")
+            elif modifier == "any":
+                return lambda t: bool(t.get("tags"))
+            raise UnsupportedFilter(f"modifier `tags.{modifier}`")
+        if name in self.numbers:
+            try:
+                number = float(value)
+            except ValueError:
+                raise UnsupportedFilter(f"numeric value `{value}`")
+            ops = {
+                None: lambda a: a == number, "is": lambda a: a == number, "equals": lambda a: a == number,
+                "not": lambda a: a != number, "isnt": lambda a: a != number,
+                "above": lambda a: a > number, "over": lambda a: a > number,
+                "below": lambda a: a < number, "under": lambda a: a < number,
+            }
+            if modifier not in ops:
+                raise UnsupportedFilter(f"modifier `{name}.{modifier}`")
+            op = ops[modifier]
+            return lambda t: name in t and op(float(t[name]))
+
+        def val(t):
+            return str(t.get(name, ""))
+        def left(t):
+            if name in self.hierarchies:
+                # `project:home` matches home and home.*, but not homework.
+                return val(t) == value or val(t).startswith(value + ".")
+            return val(t).startswith(value)
+        # Taskwarrior's default string comparison is a left match.
+        ops = {
+            None        : lambda t: left(t) if value else name not in t,
+            "is"        : lambda t: val(t) == value,
+            "equals"    : lambda t: val(t) == value,
+            "isnt"      : lambda t: val(t) != value,
+            "not"       : lambda t: not left(t) if value else name in t,
+            "has"       : lambda t: value in val(t),
+            "contains"  : lambda t: value in val(t),
+            "hasnt"     : lambda t: value not in val(t),
+            "startswith": lambda t: val(t).startswith(value),
+            "left"      : lambda t: val(t).startswith(value),
+            "endswith"  : lambda t: val(t).endswith(value),
+            "right"     : lambda t: val(t).endswith(value),
+            "none"      : lambda t: not val(t),
+            "any"       : lambda t: bool(val(t)),
+        }
+        if modifier not in ops:
+            raise UnsupportedFilter(f"modifier `{name}.{modifier}`")
+        return ops[modifier]
+
+
+def call_taskwarrior(args:list[str] = ["export"], taskfile = ".task", timeout = None, input = None) -> str:
     # Local file.
     env = os.environ.copy()
     env["TASKDATA"] = taskfile
@@ -498,12 +1623,18 @@ def call_taskwarrior(args:list[str] = ["export"], taskfile = ".task") -> str:
     # print(cmd)
     try:
         p = subprocess.Popen( " ".join(cmd),
+            stdin=subprocess.PIPE if input is not None else None,
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
             shell=True,
             env=env,
         )
-        out, err = p.communicate()
+        try:
+            out, err = p.communicate(input = input.encode("utf-8") if input is not None else None, timeout = timeout)
+        except subprocess.TimeoutExpired:
+            p.kill()
+            p.communicate()
+            raise
 
     except subprocess.CalledProcessError as exc:
         print("ERROR:", exc.returncode, exc.output, err)
@@ -512,16 +1643,790 @@ def call_taskwarrior(args:list[str] = ["export"], taskfile = ".task") -> str:
         return out.decode("utf-8")
 
 
-def get_data(taskfile, filter = None):
+class ExportError(Exception):
+    """Taskwarrior failed to export the tasks, or its output is not valid."""
+    pass
+
+def json_loads():
+    """The fastest available JSON decoder."""
+    try:
+        return timed_import("orjson").loads
+    except ImportError:
+        return json.loads
+
+
+def decode_export(lines, projection = None):
+    """Yield the tasks of the lines of a `task export`, one by one.
+
+    Taskwarrior writes one task per line, but tasks spanning several lines,
+    or a whole array on a single line, are handled as well.
+    Raises ExportError on invalid or truncated output.
+    """
+    loads = json_loads()
+    # JSON strings cannot span lines, drop them to count the brackets.
+    strings = re.compile(rb'"(?:[^"\\]|\\.)*"')
+    pending = []
+    depth = 0
+    value = None
+    opened = closed = False
+    n = start = 0
+    for n,line in enumerate(lines, 1):
+        line = line.strip()
+        if not pending:
+            if not line:
+                continue
+            if closed:
+                raise ExportError(f"unexpected data after the end of the export, at line {n}")
+            if line == b"[":
+                opened = True
+                continue
+            if line == b"]":
+                closed = True
+                continue
+            start = n
+            depth = 0
+            try:
+                value = loads(line[:-1] if line.endswith(b",") else line)
+            except ValueError:
+                value = None
+        if pending or value is None:
+            # Only parse again once the brackets opened by the first line are closed.
+            pending.append(line)
+            bare = strings.sub(b"", line)
+            depth += bare.count(b"{") + bare.count(b"[") - bare.count(b"}") - bare.count(b"]")
+            if depth > 0 and pending[0][:1] in (b"{", b"["):
+                continue
+            text = b"\n".join(pending)
+            try:
+                value = loads(text[:-1] if text.endswith(b",") else text)
+            except ValueError:
+                raise ExportError(f"invalid output at line {start}: {pending[0][:50].decode(errors = 'replace').strip()}…")
+        pending = []
+        for task in value if type(value) == list else [value]:
+            if type(task) != dict:
+                raise ExportError(f"not a task at line {n}: {str(task)[:50]}")
+            yield projection(task) if projection else task
+    if pending:
+        raise ExportError(f"truncated output at line {start}: {pending[0][:50].decode(errors = 'replace').strip()}…")
+    if opened and not closed:
+        raise ExportError(f"truncated output, after {n} lines")
+
+
+def export_tasks(taskfile, filter = [], projection = None):
+    """Yield the exported tasks while taskwarrior writes them."""
+    env = os.environ.copy()
+    env["TASKDATA"] = str(taskfile)
+    p = subprocess.Popen(" ".join(["task"] + filter + ["export"]),
+        stdout = subprocess.PIPE,
+        stderr = subprocess.PIPE,
+        shell = True,
+        env = env,
+    )
+    # Read errors aside, so that a full stderr pipe cannot block taskwarrior.
+    errors = []
+    reader = threading.Thread(target = lambda: errors.append(p.stderr.read()), daemon = True)
+    reader.start()
+    invalid = None
+    try:
+        yield from decode_export(p.stdout, projection)
+    except ExportError as exc:
+        invalid = exc
+    finally:
+        p.stdout.close()
+        code = p.wait()
+        reader.join()
+    # Taskwarrior's own error tells more than its partial output.
+    if code != 0:
+        raise ExportError(f"`task export` failed with code {code}: {b''.join(errors).decode(errors = 'replace').strip()}")
+    if invalid:
+        raise invalid
+
+
+def get_data(taskfile, filter = None, cache = False, projection = None):
+    """Export the tasks, as dictionaries or as the records of the given Projection.
+
+    Raises ExportError if taskwarrior fails.
+    """
     if not filter:
         filter = []
-    out = call_taskwarrior(filter+["export"], taskfile)
+    fields = projection.fields if projection else ()
+    if cache:
+        # Taken before exporting, so that a write during the export invalidates the entry.
+        signature = export_cache.signature(taskfile)
+        jdata = export_cache.load(taskfile, filter, fields, signature)
+        if jdata is not None:
+            return jdata
+    with timings.span("export"):
+        jdata = list(export_tasks(taskfile, filter, projection))
+    if cache:
+        export_cache.save(taskfile, filter, jdata, fields, signature)
+    return jdata
+
+
+def cache_dir():
+    """Directory holding TWD's caches."""
+    base = os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache"))
+    return pathlib.Path(base) / "taskwarrior-deluxe"
+
+
+def file_signature(paths):
+    """Identify the state of the given files by their size, mtime and inode."""
+    sig = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except OSError:
+            sig.append((str(path), None))
+        else:
+            sig.append((str(path), st.st_size, st.st_mtime_ns, st.st_ino))
+    return sig
+
+
+class ExportCache:
+    """On-disk cache of parsed exports, one entry per data directory and filter.
+
+    An entry is valid as long as the data files and the taskwarrior
+    configuration did not change, and for at most `ttl` seconds,
+    because urgencies drift with time.
+    """
+    data_files = ["pending.data", "completed.data"]
+
+    def __init__(self, ttl = 600):
+        self.ttl = ttl
+        self.stats = {"hit": 0, "miss": 0}
+
+    def path(self, taskfile, filter, fields = ()):
+        key = str(pathlib.Path(os.path.expanduser(str(taskfile))).resolve()) + "\0" + " ".join(filter)
+        if fields:
+            key += "\0" + ",".join(fields)
+        return cache_dir() / f"export-{hashlib.sha1(key.encode()).hexdigest()}.pickle"
+
+    def signature(self, taskfile):
+        data = pathlib.Path(os.path.expanduser(str(taskfile)))
+        taskrc = os.environ.get("TASKRC", os.path.expanduser("~/.taskrc"))
+        return file_signature([data / f for f in self.data_files] + [taskrc])
+
+    def load(self, taskfile, filter, fields = (), signature = None):
+        if signature is None:
+            signature = self.signature(taskfile)
+        try:
+            with open(self.path(taskfile, filter, fields), "rb") as fd:
+                entry = pickle.load(fd)
+        except (OSError, pickle.PickleError, EOFError, AttributeError):
+            entry = None
+        if entry and entry["filter"] == filter and entry.get("fields", ()) == tuple(fields) \
+           and entry["signature"] == signature \
+           and 0 <= datetime.datetime.now().timestamp() - entry["time"] < self.ttl:
+            self.stats["hit"] += 1
+            return entry["data"]
+        self.stats["miss"] += 1
+        return None
+
+    def save(self, taskfile, filter, jdata, fields = (), signature = None):
+        """Store the tasks, under the `signature` of the data files taken before exporting them."""
+        entry = {
+            "filter": filter,
+            "fields": tuple(fields),
+            "signature": signature if signature is not None else self.signature(taskfile),
+            "time": datetime.datetime.now().timestamp(),
+            "data": jdata,
+        }
+        path = self.path(taskfile, filter, fields)
+        try:
+            path.parent.mkdir(parents = True, exist_ok = True)
+            tmp = path.with_suffix(f".{os.getpid()}.tmp")
+            with open(tmp, "wb") as fd:
+                pickle.dump(entry, fd, protocol = pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, path)
+        except OSError as exc:
+            logging.warning(f"Cannot write the export cache: {exc}")
+
+    def record_stats(self):
+        """Add this run's hits and misses to the persistent counters, and return those."""
+        path = cache_dir() / "stats.json"
+        try:
+            with open(path) as fd:
+                total = json.load(fd)
+        except (OSError, ValueError):
+            total = {"hit": 0, "miss": 0}
+        if self.stats["hit"] or self.stats["miss"]:
+            for k in self.stats:
+                total[k] = total.get(k, 0) + self.stats[k]
+            try:
+                path.parent.mkdir(parents = True, exist_ok = True)
+                with open(path, "w") as fd:
+                    json.dump(total, fd)
+            except OSError as exc:
+                logging.warning(f"Cannot write the cache statistics: {exc}")
+        return total
+
+export_cache = ExportCache()
+
+
+class Urgency:
+    """Compute taskwarrior's urgency from the `urgency.*` coefficients of the config."""
+    defaults = {
+        "urgency.user.tag.next.coefficient": 15.0,
+        "urgency.due.coefficient": 12.0,
+        "urgency.blocking.coefficient": 8.0,
+        "urgency.uda.priority.H.coefficient": 6.0,
+        "urgency.uda.priority.M.coefficient": 3.9,
+        "urgency.uda.priority.L.coefficient": 1.8,
+        "urgency.scheduled.coefficient": 5.0,
+        "urgency.active.coefficient": 4.0,
+        "urgency.age.coefficient": 2.0,
+        "urgency.annotations.coefficient": 1.0,
+        "urgency.tags.coefficient": 1.0,
+        "urgency.project.coefficient": 1.0,
+        "urgency.blocked.coefficient": -5.0,
+        "urgency.waiting.coefficient": -3.0,
+        "urgency.age.max": 365,
+    }
+
+    def __init__(self, config, now = None):
+        self.now = now if now else time.time()
+        coefs = dict(self.defaults)
+        for k in config:
+            if k.startswith("urgency."):
+                try:
+                    coefs[k] = float(config[k])
+                except ValueError:
+                    pass
+        self.coef = lambda name: coefs.get(f"urgency.{name}.coefficient", 0.0)
+        self.age_max = coefs["urgency.age.max"]
+        self.tags = {}
+        self.projects = {}
+        self.keywords = {}
+        self.udas = {}
+        for k,v in coefs.items():
+            m = re.fullmatch(r"urgency\.(user\.tag|user\.project|user\.keyword|uda)\.(.+)\.coefficient", k)
+            if m:
+                kind = {"user.tag": self.tags, "user.project": self.projects, "user.keyword": self.keywords, "uda": self.udas}
+                kind[m.group(1)][m.group(2)] = v
+
+    @staticmethod
+    def ramp(n):
+        return {0: 0.0, 1: 0.8, 2: 0.9}.get(n, 1.0)
+
+    def __call__(self, task, epochs, blocked, blocking):
+        u = 0.0
+        if "project" in task:
+            u += self.coef("project")
+        if "start" in task:
+            u += self.coef("active")
+        if "scheduled" in epochs and epochs["scheduled"] < self.now:
+            u += self.coef("scheduled")
+        if task.get("status") == "waiting" or epochs.get("wait", 0) > self.now:
+            u += self.coef("waiting")
+        if blocked:
+            u += self.coef("blocked")
+        if blocking:
+            u += self.coef("blocking")
+        u += self.ramp(len(task.get("annotations", []))) * self.coef("annotations")
+        tags = task.get("tags", [])
+        u += self.ramp(len(tags)) * self.coef("tags")
+        if "due" in epochs:
+            days = (self.now - epochs["due"]) / 86400
+            if days >= 7:
+                d = 1.0
+            elif days >= -14:
+                d = ((days + 14) * 0.8 / 21) + 0.2
+            else:
+                d = 0.2
+            u += d * self.coef("due")
+        if "entry" in epochs:
+            age = (self.now - epochs["entry"]) / 86400
+            if self.age_max == 0 or age > self.age_max:
+                u += self.coef("age")
+            else:
+                u += age / self.age_max * self.coef("age")
+        for tag,c in self.tags.items():
+            if tag in tags:
+                u += c
+        for project,c in self.projects.items():
+            if task.get("project", "").startswith(project):
+                u += c
+        for keyword,c in self.keywords.items():
+            if keyword in task.get("description", ""):
+                u += c
+        for uda,c in self.udas.items():
+            if "." in uda:
+                # Value-specific coefficient, like `uda.priority.H`.
+                name,value = uda.split(".", 1)
+                if task.get(name) == value:
+                    u += c
+            elif uda in task:
+                u += c
+        return round(u, 5)
+
+
+class Record:
+    """A task reduced to the fields of its Projection, seen as a read-only mapping.
+
+    Dates are stored as epoch seconds, and given back in taskwarrior's format.
+    """
+    __slots__ = ("projection", "values")
+
+    def __init__(self, projection, values):
+        self.projection = projection
+        self.values = values
+
+    def __getitem__(self, key):
+        value = self.values[self.projection.index[key]]
+        if value is None:
+            raise KeyError(key)
+        if key in self.projection.dates:
+            return self.projection.stamp(value)
+        return value
+
+    def get(self, key, default = None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        i = self.projection.index.get(key)
+        return i is not None and self.values[i] is not None
+
+    def keys(self):
+        return [k for k,v in zip(self.projection.fields, self.values) if v is not None]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def items(self):
+        return [(k, self[k]) for k in self.keys()]
+
+    def __getstate__(self):
+        return (self.projection, self.values)
+
+    def __setstate__(self, state):
+        self.projection, self.values = state
+
+    def __repr__(self):
+        return f"Record({dict(self.items())})"
+
+
+class Projection:
+    """Build compact records of tasks, keeping only some of their fields.
+
+    Status and priority are interned, dates are converted to epoch seconds.
+    """
+    interned = ["status", "priority"]
+
+    def __init__(self, fields):
+        self.fields = tuple(sorted(set(fields)))
+        self.index = {k: i for i,k in enumerate(self.fields)}
+        self.dates = set(date_fields) & set(self.fields)
+        self.converted = [i for i,k in enumerate(self.fields) if k in self.dates or k in self.interned]
+        self.epochs = {}
+        self.stamps = {}
+
+    def epoch(self, stamp):
+        try:
+            return self.epochs[stamp]
+        except KeyError:
+            pass
+        if len(stamp) == 16 and stamp[8] == "T" and stamp[15] == "Z":
+            epoch = calendar.timegm( (int(stamp[0:4]), int(stamp[4:6]), int(stamp[6:8]),
+                int(stamp[9:11]), int(stamp[11:13]), int(stamp[13:15])) )
+        else:
+            epoch = calendar.timegm(time.strptime(stamp, "%Y%m%dT%H%M%SZ"))
+        self.epochs[stamp] = epoch
+        return epoch
+
+    def stamp(self, epoch):
+        if epoch not in self.stamps:
+            self.stamps[epoch] = time.strftime("%Y%m%dT%H%M%SZ", time.gmtime(epoch))
+        return self.stamps[epoch]
+
+    def __call__(self, task):
+        values = [task.get(k) for k in self.fields]
+        for i in self.converted:
+            v = values[i]
+            if v is not None:
+                values[i] = self.epoch(v) if self.fields[i] in self.dates else sys.intern(v)
+        return Record(self, tuple(values))
+
+    def __getstate__(self):
+        return self.fields
+
+    def __setstate__(self, fields):
+        self.__init__(fields)
+
+
+def projected_fields(config, list_separator = ","):
+    """Fields needed to display the tasks, None if all of them are."""
+    columns = [c for c in config["report.list.columns"].split(list_separator) if c]
+    if not columns:
+        return None
+    # Used for identification, grouping by status and incremental updates.
+    fields = {"id", "uuid", "status", "start", "modified"}
+    fields |= set(columns)
+    for key in ["layout.sections.group", "layout.subsections.group", "layout.stack.sort"]:
+        if config[key]:
+            fields.add(config[key].lower() if config[key].lower() in ["status", "priority"] else config[key])
+    return fields
+
+
+data_pair = re.compile(r'([^\s:\[\]]+):"((?:[^"\\]|\\.)*)"')
+
+def decode_data_value(value):
+    if "\\" in value:
+        try:
+            value = json.loads(f'"{value}"')
+        except json.decoder.JSONDecodeError:
+            value = value.replace('\\"', '"').replace("\\/", "/")
+    if "&" in value:
+        value = value.replace("&open;", "[").replace("&close;", "]").replace("&dquot;", '"')
+    return value
+
+
+def read_data_file(filename, udas):
+    """Stream the tasks of a taskwarrior 2.x `.data` file.
+
+    Yields (task, epochs) pairs, with the task in the form of `task export`
+    and the raw timestamps of its dates.
+    """
+    dates = {"due", "end", "entry", "modified", "scheduled", "start", "until", "wait"}
+    dates |= {k for k,t in udas.items() if t == "date"}
     try:
-        jdata = json.loads(out)
-    except json.decoder.JSONDecodeError as exc:
-        print("ERROR:", exc)
+        fd = open(filename, "r")
+    except FileNotFoundError:
+        return
+    with fd:
+        for line in fd:
+            if not line.startswith("["):
+                continue
+            task = {}
+            epochs = {}
+            annotations = []
+            for k,v in data_pair.findall(line):
+                if k.startswith("tags_") or k.startswith("dep_"):
+                    continue # Redundant with tags and depends.
+                v = decode_data_value(v)
+                if k in dates:
+                    epochs[k] = int(v)
+                    task[k] = time.strftime("%Y%m%dT%H%M%SZ", time.gmtime(epochs[k]))
+                elif k.startswith("annotation_"):
+                    entry = int(k[len("annotation_"):])
+                    annotations.append((entry, v))
+                elif k == "tags" or k == "depends":
+                    task[k] = v.split(",")
+                elif k == "imask" or udas.get(k) == "numeric":
+                    task[k] = float(v) if "." in v else int(v)
+                else:
+                    task[k] = v
+            if annotations:
+                task["annotations"] = [
+                    {"entry": time.strftime("%Y%m%dT%H%M%SZ", time.gmtime(e)), "description": d}
+                    for e,d in sorted(annotations)]
+            yield task, epochs
+
+
+def read_data(taskfile, config, completed = True):
+    """Read the tasks directly from the `.data` files, without calling taskwarrior.
+
+    Returns the same data than `task export`.
+    If `completed` is False, skip completed and deleted tasks altogether.
+    """
+    udas = {}
+    for k in config:
+        m = re.fullmatch(r"uda\.(.+)\.type", k)
+        if m:
+            udas[m.group(1)] = config[k].strip()
+
+    data = pathlib.Path(os.path.expanduser(str(taskfile)))
+    tasks = []
+    i = 0
+    for task,epochs in read_data_file(data / "pending.data", udas):
+        if task.get("status") in ["pending", "waiting", "recurring"]:
+            i += 1
+            tasks.append(({"id": i, **task}, epochs))
+        elif completed:
+            tasks.append(({"id": 0, **task}, epochs))
+    if completed:
+        for task,epochs in read_data_file(data / "completed.data", udas):
+            tasks.append(({"id": 0, **task}, epochs))
+
+    pending = {t.get("uuid") for t,_ in tasks if t.get("status") in ["pending", "waiting"]}
+    blocking = set()
+    for t,_ in tasks:
+        if t.get("status") in ["pending", "waiting"]:
+            blocking.update(t.get("depends", []))
+
+    urgency = Urgency(config)
+    jdata = []
+    for t,epochs in tasks:
+        blocked = any(d in pending for d in t.get("depends", []))
+        t["urgency"] = urgency(t, epochs, blocked, t.get("uuid") in blocking)
+        jdata.append(t)
+    return jdata
+
+
+def wants_completed(config, list_separator = ","):
+    """False if no section is configured to show completed or deleted tasks."""
+    for level in ["layout.sections", "layout.subsections"]:
+        if level == "layout.subsections" and not config[level]:
+            continue
+        field = config[f"{level}.group"].lower()
+        if field and field != "status":
+            return True
+        values = config[f"{level}.group.show"].split(list_separator)
+        if not field or values == [""]:
+            values = ["pending","started","completed"]
+        if "completed" not in values and "deleted" not in values:
+            return False
+    return True
+
+
+def count_tasks(taskfile, timeout = None):
+    """Number of tasks in a database, without exporting it.
+
+    Counts the lines of the `.data` files if there are some,
+    else asks `task count`.
+    """
+    data = pathlib.Path(os.path.expanduser(str(taskfile)))
+    if (data / "pending.data").exists():
+        n = 0
+        for name in ExportCache.data_files:
+            try:
+                with open(data / name, "rb") as fd:
+                    n += sum(1 for line in fd if line.startswith(b"["))
+            except FileNotFoundError:
+                pass
+        return n
     else:
+        return int(call_taskwarrior(["count"], taskfile, timeout = timeout).strip())
+
+
+class RepoCounts:
+    """Count the tasks of several databases concurrently.
+
+    Counting starts as soon as the object is created,
+    iterating waits for the results and yields (taskfile, count) in the given order.
+    Count is None for databases that failed or did not answer in time.
+    """
+    def __init__(self, taskfiles, jobs = 8, timeout = None):
+        self.timeout = timeout
+        self.futures = []
+        if taskfiles:
+            self.pool = concurrent.futures.ThreadPoolExecutor(max_workers = max(1, jobs))
+            for taskfile in taskfiles:
+                self.futures.append( (taskfile, self.pool.submit(count_tasks, taskfile, timeout)) )
+            self.pool.shutdown(wait = False)
+
+    def __iter__(self):
+        for taskfile,future in self.futures:
+            try:
+                count = future.result(timeout = self.timeout)
+            except (concurrent.futures.TimeoutError, subprocess.TimeoutExpired, OSError, ValueError) as exc:
+                logging.warning(f"Cannot count tasks in {taskfile}: {exc!r}")
+                count = None
+            yield taskfile, count
+
+
+class RepoTasks:
+    """Export the tasks of several databases concurrently.
+
+    Exports start as soon as the object is created, at most `jobs` at a time.
+    Iterating yields (taskfile, tasks, error) in the given order, as soon as
+    each export is done, tasks being None for databases that failed.
+    """
+    def __init__(self, taskfiles, config, store, filter = None, cache = False, jobs = 8):
+        self.futures = []
+        if taskfiles:
+            self.pool = concurrent.futures.ThreadPoolExecutor(max_workers = max(1, jobs))
+            for taskfile in taskfiles:
+                self.futures.append( (taskfile, self.pool.submit(self.export, taskfile, config, store, filter, cache)) )
+            self.pool.shutdown(wait = False)
+
+    @staticmethod
+    def export(taskfile, config, store, filter, cache):
+        jdata = store.get(taskfile, config, cache = cache)
+        if jdata is None:
+            raise ExportError("no data")
+        return filter_data(jdata, filter, taskfile, cache)
+
+    def __iter__(self):
+        for taskfile,future in self.futures:
+            try:
+                yield taskfile, future.result(), None
+            except (ExportError, OSError, ValueError) as exc:
+                logging.warning(f"Cannot export tasks in {taskfile}: {exc!r}")
+                yield taskfile, None, exc
+
+
+def filter_data(jdata, filter, taskfile, cache = False):
+    """Apply a taskwarrior filter on already exported tasks.
+
+    Only asks taskwarrior for a new export if the filter cannot be evaluated here.
+    """
+    if not filter:
         return jdata
+    projection = jdata[0].projection if jdata and isinstance(jdata[0], Record) else None
+    try:
+        f = Filter(filter)
+        if projection and not f.fields <= set(projection.fields):
+            raise UnsupportedFilter(f"fields {', '.join(sorted(f.fields - set(projection.fields)))} were not kept")
+    except UnsupportedFilter as exc:
+        logging.debug(f"Filter evaluated by taskwarrior: {exc}")
+        return get_data(taskfile, filter, cache, projection)
+    else:
+        return f(jdata)
+
+
+class UnsupportedOperation(Exception):
+    """The batched command cannot be applied on the exported tasks, and should be run by taskwarrior."""
+    pass
+
+class Batch:
+    """Apply many taskwarrior commands, with as few calls to taskwarrior as possible.
+
+    Commands on IDs or UUIDs that only change tags, project, priority, description
+    or status are applied on the exported tasks, which are then saved
+    with a single `task import`. Other commands, including `add`, are run
+    by taskwarrior, after the pending modifications have been imported.
+    """
+    commands = ["add", "modify", "done", "start", "stop", "delete"]
+    attributes = ["project", "priority", "description"]
+
+    def __init__(self, taskfile):
+        self.taskfile = taskfile
+        self.tasks = None
+        self.changed = {}
+        self.touched = []
+        self.outputs = []
+
+    def now(self):
+        return time.strftime("%Y%m%dT%H%M%SZ", time.gmtime())
+
+    def select(self, words):
+        if not words:
+            raise UnsupportedOperation("no filter")
+        ids, uuids = set(), []
+        for word in words:
+            more = Filter.as_ids(word)
+            if more[0] is None:
+                raise UnsupportedOperation(f"filter `{word}`")
+            ids |= more[0]
+            uuids += more[1]
+        if self.tasks is None:
+            try:
+                self.tasks = get_data(self.taskfile)
+            except ExportError as exc:
+                raise UnsupportedOperation(f"cannot export: {exc}")
+        selected = [t for t in self.tasks if (t.get("id") in ids and t.get("id")) \
+            or any(t.get("uuid","").startswith(u) for u in uuids)]
+        if not selected:
+            raise UnsupportedOperation("no matching task")
+        return selected
+
+    def modify(self, task, words):
+        description = []
+        for word in words:
+            m = re.fullmatch(r"([A-Za-z_][\w\-.]*):(.*)", word)
+            if word == "--" or word.startswith("rc.") \
+                or (word[0] in "+-" and len(word) > 1 and (word[1] in "+-" or any(c.isupper() for c in word[1:]))):
+                # Overrides and virtual tags are left to taskwarrior.
+                raise UnsupportedOperation(f"modification `{word}`")
+            elif word[0] in "+-" and len(word) > 1:
+                tags = [t for t in task.get("tags", []) if t != word[1:]]
+                if word[0] == "+":
+                    tags.append(word[1:])
+                task["tags"] = tags
+                if not tags:
+                    del task["tags"]
+            elif m and m.group(1) in self.attributes:
+                if m.group(1) == "priority" and m.group(2) not in ["H", "M", "L", ""]:
+                    raise UnsupportedOperation(f"priority `{m.group(2)}`")
+                if m.group(2):
+                    task[m.group(1)] = m.group(2)
+                else:
+                    task.pop(m.group(1), None)
+            elif m or word in ["and", "or", "xor", "(", ")"] or "/" in word:
+                raise UnsupportedOperation(f"modification `{word}`")
+            else:
+                description.append(word)
+        if description:
+            task["description"] = " ".join(description)
+
+    def apply(self, words):
+        """Apply a command on the exported tasks, or raise UnsupportedOperation."""
+        verbs = [i for i,w in enumerate(words) if w in self.commands]
+        if not verbs:
+            raise UnsupportedOperation("unknown command")
+        i = verbs[0]
+        verb, filter, mods = words[i], words[:i], words[i+1:]
+        now = self.now()
+        if verb == "add":
+            # Taskwarrior applies the default.* settings (some of which are dates) and the hooks.
+            raise UnsupportedOperation("add")
+        if verb != "modify" and mods:
+            raise UnsupportedOperation(f"arguments to {verb}")
+        tasks = []
+        for task in self.select(filter):
+            task = dict(self.changed.get(task["uuid"], task))
+            if verb == "modify":
+                self.modify(task, mods)
+            elif verb == "done":
+                task["status"] = "completed"
+                task["end"] = now
+                task.pop("start", None)
+            elif verb == "delete":
+                task["status"] = "deleted"
+                task["end"] = now
+            elif verb == "start":
+                task["start"] = now
+            elif verb == "stop":
+                task.pop("start", None)
+            tasks.append(task)
+        for task in tasks:
+            task["modified"] = now
+            self.changed[task["uuid"]] = task
+            if task["uuid"] not in self.touched:
+                self.touched.append(task["uuid"])
+
+    def flush(self):
+        """Import the modified tasks."""
+        if self.changed:
+            tasks = [{k:v for k,v in t.items() if k not in ["id", "urgency"]} for t in self.changed.values()]
+            self.outputs.append( call_taskwarrior(["import", "-"], self.taskfile, input = json.dumps(tasks)) )
+            self.changed = {}
+        # IDs may have changed.
+        self.tasks = None
+
+    def __call__(self, commands):
+        """Run all the commands, returns the UUIDs of the tasks they touched.
+
+        Commands are strings, as typed in a shell, or lists of arguments.
+        """
+        for command in commands:
+            words = shlex.split(command, comments = True) if type(command) == str else list(command)
+            if not words:
+                continue
+            try:
+                self.apply(words)
+            except UnsupportedOperation as exc:
+                logging.debug(f"Command run by taskwarrior ({exc}): {words}")
+                self.flush()
+                out = call_taskwarrior([shlex.quote(w) for w in words], self.taskfile)
+                self.outputs.append(out)
+                self.touched += parse_touched(out)
+        self.flush()
+        return self.touched
+
+
+def batch(commands, taskfile = ".task"):
+    """Apply the given taskwarrior commands, see `Batch`.
+
+    Returns the UUIDs (or IDs, for commands run by taskwarrior) of the touched tasks.
+    """
+    return Batch(taskfile)(commands)
 
 
 def parse_touched(out):
@@ -575,6 +2480,7 @@ def get_layouts(kind = None, name = None):
         "sections": {
             "Vertical": sections.Vertical,
             "Horizontal": sections.Horizontal,
+            "Kanban": sections.Kanban,
         },
     }
     if kind and name:
@@ -616,8 +2522,18 @@ def tw_to_rich(color):
 
 # We cannot use tomllib because strings are not quoted.
 # We cannot use configparser because there is no section and because of the "include" command.
-def parse_config(filename, current):
+def parse_config(filename, current, files = None, including = ()):
+    """Add the configuration of the given file to the current one.
+
+    If `files` is a list, the path of every parsed file is appended to it.
+    """
     config = current
+    real = os.path.realpath(filename)
+    if real in including:
+        print(f"Config file `{filename}` is included in itself, I'll ignore it.")
+        return config
+    if files is not None:
+        files.append(real)
     with open(filename, "r") as fd:
         for i,line in enumerate(fd.readlines()):
             if line.strip() and line.strip()[0] != "#": # Starting comment.
@@ -633,7 +2549,7 @@ def parse_config(filename, current):
                 elif "include" in line:
                     _,path = line.split()
                     # Recursively add/replace with the included config.
-                    config.update( parse_config(os.path.expanduser(path.strip()), config) )
+                    config.update( parse_config(os.path.expanduser(path.strip()), config, files, including + (real,)) )
                 else:
                     print(f"Cannot parse line {i} of config file `{filename}`, I'll ignore it.")
     return config
@@ -654,25 +2570,26 @@ def upsearch(filename, at = pathlib.Path.cwd()):
 
     while current != root:
         found = current / filename
-        if os.access(found, os.R_OK) and found.exists():
+        # Fails for missing files too.
+        if os.access(found, os.R_OK):
             return found
         current = current.parent
 
     return None
 
 
-def find_config(fname, current):
+def find_config(fname, current, files = None):
     config = current
 
     # First, system.
     p = pathlib.Path("/etc/taskwarrior") / pathlib.Path(fname)
     if p.exists():
-        config = parse_config(p, config)
+        config = parse_config(p, config, files)
 
     # Second, user.
     p = pathlib.Path(os.path.expanduser("~")) / pathlib.Path(fname)
     if p.exists():
-        config = parse_config(p, config)
+        config = parse_config(p, config, files)
 
     # Third, upper dirs.
     # LIFO queue allows to fill from current dir,
@@ -686,11 +2603,138 @@ def find_config(fname, current):
 
     while not updirs.empty():
         f = updirs.get()
-        config = parse_config(f, config)
+        config = parse_config(f, config, files)
 
     return config
 
 
+def config_candidates(fname, here):
+    """All the places where find_config would look for `fname`."""
+    candidates = [
+        pathlib.Path("/etc/taskwarrior") / fname,
+        pathlib.Path(os.path.expanduser("~")) / fname,
+    ]
+    root = pathlib.Path(here.root)
+    while here != root:
+        candidates.append(here / fname)
+        here = here.parent
+    return candidates
+
+
+class RepoIndex:
+    """Task databases found under a root directory, in a single traversal.
+
+    The traversal is cached on disk, a directory being listed again only if its mtime changed.
+    Enclosing and children repositories of the indexed directories are then simple lookups.
+    """
+    def __init__(self, root, depth = 4, ignore = [".git", "node_modules"]):
+        self.root = os.path.abspath(root)
+        self.depth = depth
+        self.ignore = [i for i in ignore if i]
+        # Directory: (mtime, subdirectories, has a database).
+        self.dirs = {}
+        # Directory: closest enclosing database.
+        self.enclosed = {}
+        # Root and databases directories: closest databases under it.
+        self.kids = {}
+
+    def path(self):
+        key = "\0".join([self.root, str(self.depth)] + self.ignore)
+        return cache_dir() / f"repos-{hashlib.sha1(key.encode()).hexdigest()}.pickle"
+
+    def ignored(self, name):
+        return name == ".task" or any(fnmatch.fnmatch(name, i) for i in self.ignore)
+
+    def listdir(self, path):
+        subdirs = []
+        repo = False
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.name == ".task":
+                    repo = os.access(entry.path, os.R_OK)
+                elif not self.ignored(entry.name):
+                    try:
+                        if entry.is_dir():
+                            subdirs.append(entry.name)
+                    except OSError:
+                        pass
+        return sorted(subdirs), repo
+
+    def scan(self, cache = True):
+        known = {}
+        if cache:
+            try:
+                with open(self.path(), "rb") as fd:
+                    known = pickle.load(fd)
+            except (OSError, pickle.PickleError, EOFError, AttributeError):
+                pass
+
+        self.dirs = {}
+        self.enclosed = {}
+        self.kids = {self.root: []}
+        # Directory, depth, closest enclosing database directory.
+        todo = [(self.root, 0, None)]
+        while todo:
+            path, depth, enclosing = todo.pop()
+            if path in self.dirs:
+                continue # Already seen through a symlink.
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except OSError:
+                continue
+            entry = known.get(path)
+            if not entry or entry[0] != mtime:
+                try:
+                    entry = (mtime, *self.listdir(path))
+                except OSError:
+                    continue
+            self.dirs[path] = entry
+            _, subdirs, repo = entry
+            if repo:
+                if path != self.root:
+                    self.kids[enclosing if enclosing else self.root].append(path)
+                    self.kids[path] = []
+                enclosing = path
+            self.enclosed[path] = enclosing
+            if depth < self.depth:
+                for name in reversed(subdirs):
+                    todo.append( (os.path.join(path, name), depth+1, enclosing) )
+
+        if cache and self.dirs != known:
+            try:
+                path = self.path()
+                path.parent.mkdir(parents = True, exist_ok = True)
+                tmp = path.with_suffix(f".{os.getpid()}.tmp")
+                with open(tmp, "wb") as fd:
+                    pickle.dump(self.dirs, fd, protocol = pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp, path)
+            except OSError as exc:
+                logging.warning(f"Cannot write the repositories index: {exc}")
+        return self
+
+    def enclosing(self, path):
+        """Closest database at or above `path`."""
+        path = os.path.abspath(path)
+        if path in self.enclosed:
+            if self.enclosed[path]:
+                return pathlib.Path(self.enclosed[path]) / ".task"
+            path = os.path.dirname(self.root)
+            if path == self.root:
+                return None
+        return upsearch(".task", pathlib.Path(path))
+
+    def children(self, path = None):
+        """Closest databases under the root or under a database directory."""
+        path = os.path.abspath(path) if path else self.root
+        return [pathlib.Path(p) / ".task" for p in self.kids.get(path, [])]
+
+
+def repo_index(root, config, depth = None, cache = True):
+    if depth is None:
+        depth = int(config["repos.depth"])
+    return RepoIndex(root, depth, config["repos.ignore"].split(",")).scan(cache)
+
+
 def find_tasks(fname, current, config):
     tfile = upsearch(fname, current)
     if tfile:
@@ -701,91 +2745,534 @@ def find_tasks(fname, current, config):
         return None
 
 
+tw_commands = [
+    "active", "all", "annotate", "append", "blocked", "blocking", "burndown", "burndown", "burndown", "completed",
+    "count", "delete", "denotate", "done", "duplicate", "edit", "export", "ghistory", "ghistory", "ghistory", "ghistory",
+    "history", "history", "history", "history", "ids", "information", "list", "long", "ls", "minimal",
+    "modify", "newest", "next", "oldest", "overdue", "prepend", "projects", "purge", "ready", "recurring", "start",
+    "stats", "stop", "summary", "tags", "timesheet", "unblocked", "uuids", "waiting",
+]
+
+# Commands that only display tasks, which TWD does better.
+tw_reports = [
+    "active", "all", "blocked", "blocking", "completed", "list", "long", "ls", "minimal",
+    "newest", "next", "oldest", "overdue", "ready", "recurring", "unblocked", "waiting",
+]
+
 def parse_filter(cmd):
-    tw_commands = [
-        "active", "all", "annotate", "append", "blocked", "blocking", "burndown", "burndown", "burndown", "completed",
-        "count", "delete", "denotate", "done", "duplicate", "edit", "export", "ghistory", "ghistory", "ghistory", "ghistory",
-        "history", "history", "history", "history", "ids", "information", "list", "long", "ls", "minimal",
-        "modify", "newest", "next", "oldest", "overdue", "prepend", "projects", "purge", "ready", "recurring", "start",
-        "stats", "stop", "summary", "tags", "timesheet", "unblocked", "uuids", "waiting",
-    ]
     for i,w in enumerate(cmd):
         if w in tw_commands:
             filter = cmd[:i]
             return filter
     return None
 
-if __name__ == "__main__":
 
-    default_conf = {
-        # taskwarrior
-        "report.list.columns": "id,priority,description,tags",
-        "rule.precedence.color": "",
-
-        # taskwarrior-deluxe
-        "layout.task": "Raw",
-        "layout.stack": "RawTable",
-        "layout.stack.sort": "urgency",
-        "layout.stack.sort.reverse": "false", # urgency and priority are numeric.
-        "layout.subsections": "",
-        "layout.subsections.group": "",
-        "layout.subsections.group.show": "",
-        "layout.sections": "Horizontal",
-        "layout.sections.group": "status",
-        "layout.sections.group.show": "",
-        "widget.card.wrap": "25",
-        "list.filtered": "false",
-    }
+def is_report(cmd):
+    """True if the command only displays tasks and would not change the database.
+
+    Conservative: anything that does not look like a filter is considered
+    to be a (possibly abbreviated) editing command.
+    """
+    for w in cmd:
+        if w in tw_reports:
+            return True
+        if not re.fullmatch(r"[0-9,\-]+|[0-9a-f\-]{8,36}|[+\-]\w+|[\w.]+:\S*|and|or|xor|\(|\)", w):
+            return False
+    # Bare filters call the default report.
+    return True
+
+
+# Options handled by TWD itself, not passed to taskwarrior.
+twd_options = {
+    "no-cache": "do not use the export cache nor the config snapshot",
+    "cache-stats": "print the export cache statistics",
+    "stream": "print tasks progressively, by chunks",
+    "limit": "print at most this number of tasks, when streaming",
+    "daemon": "serve requests of other twd calls, keeping data in memory",
+    "no-daemon": "do not forward the call to a running daemon",
+    "profile-startup": "print the time spent in imports and in each step",
+    "timings": "print the time spent in each step and hot function, as JSON lines with `--timings=json`",
+    "profile": "save a cProfile of the run in the given file (`twd.pstats` by default)",
+    "repos": "display the tasks of all the databases under the current directory, on a single board",
+    "format": "output format: rich, json (lines), csv, tsv, html or auto (rich on a terminal, json otherwise)",
+}
 
+def parse_options(argv):
+    """Separate TWD's `--options` from taskwarrior's arguments."""
+    options = {}
+    cmd = []
+    for arg in argv:
+        name, _, value = arg[2:].partition("=")
+        if arg.startswith("--") and name in twd_options:
+            options[name] = value if value else True
+        else:
+            cmd.append(arg)
+    return options, cmd
+
+default_conf = {
+    # taskwarrior
+    "report.list.columns": "id,priority,description,tags",
+    "rule.precedence.color": "",
+
+    # taskwarrior-deluxe
+    "layout.task": "Raw",
+    "layout.stack": "RawTable",
+    "layout.stack.sort": "urgency",
+    "layout.stack.sort.reverse": "false", # urgency and priority are numeric.
+    "layout.stack.limit": "", # tasks per stack, `layout.stack.limit.<group value>` for a given group
+    "layout.subsections": "",
+    "layout.subsections.group": "",
+    "layout.subsections.group.show": "",
+    "layout.sections": "Horizontal",
+    "layout.sections.group": "status",
+    "layout.sections.group.show": "",
+    "widget.card.wrap": "25",
+    "list.filtered": "false",
+    "data.cache": "true",
+    "data.cache.ttl": "600", # seconds
+    "data.native": "false",
+    "data.compact": "false", # only keep the displayed fields in memory
+    "repos.jobs": "8",
+    "repos.timeout": "5", # seconds
+    "repos.depth": "4", # directories levels indexed by `twd tree`
+    "repos.ignore": ".git,node_modules", # directories patterns not indexed
+    "layout.repos": "Vertical", # sections of the databases, with `--repos`
+    "layout.stream": "false",
+    "layout.parallel.jobs": "0", # experimental: processes rendering the sections, 0 to render serially, auto for one per CPU
+    "layout.parallel.min": "1000", # tasks under which the board is rendered serially
+    "layout.stream.chunk": "50", # tasks
+    "layout.stream.limit": "", # tasks
+    "list.edited": "true", # display tasks after an editing command
+    "watch.poll": "1", # seconds between checks of the data files, without inotify
+    "watch.dates": "60", # seconds between updates of the relative dates
+    "watch.touched": "300", # seconds during which changed tasks are highlighted
+    "output.format": "rich", # or json, csv, tsv, html, auto for json when not on a terminal
+    "summary.due": "1", # next due dates shown by `twd summary`
+}
+
+
+def load_config(cache = True):
+    if cache:
+        return config_snapshots.load(pathlib.Path.cwd())
     # First, taskwarrior"s config...
-    config = find_config(".taskrc", default_conf)
+    config = find_config(".taskrc", dict(default_conf))
     # ... overwritten by TWD config.
     config = find_config(".twdrc", config)
+    return config
 
-    # for k in config:
-    #     print(k,"=",config[k])
 
-    taskfile = find_tasks(".task", pathlib.Path.cwd(), config)
-    if not taskfile:
-        error("NO_DATA_FILE", "Cannot find a data file here, in a parent directory, or configured.")
+class ConfigSnapshots:
+    """Merged configurations, kept in memory and on disk, for each working directory.
 
-    cmd = sys.argv[1:]
+    A snapshot is valid as long as none of the files that were parsed
+    (including the included ones) changed, and no new config file appeared
+    where find_config looks for them.
+    """
+    def __init__(self):
+        self.snapshots = {}
 
-    if len(cmd) == 1 and cmd[0] == "init":
+    def path(self, here):
+        return cache_dir() / f"config-{hashlib.sha1(str(here).encode()).hexdigest()}.pickle"
+
+    def load(self, here):
+        snapshot = self.snapshots.get(here)
+        if not snapshot:
+            try:
+                with open(self.path(here), "rb") as fd:
+                    snapshot = pickle.load(fd)
+            except (OSError, pickle.PickleError, EOFError, AttributeError):
+                snapshot = None
+        if snapshot and file_signature(snapshot["paths"]) == snapshot["signature"]:
+            self.snapshots[here] = snapshot
+            return snapshot["config"]
+
+        files = []
+        # First, taskwarrior"s config...
+        config = find_config(".taskrc", dict(default_conf), files)
+        # ... overwritten by TWD config.
+        config = find_config(".twdrc", config, files)
+
+        # Changes in TWD may change the defaults.
+        paths = [os.path.realpath(__file__)]
+        paths += [str(p) for p in config_candidates(".taskrc", here) + config_candidates(".twdrc", here)]
+        paths += [f for f in files if f not in paths]
+        snapshot = {"paths": paths, "signature": file_signature(paths), "config": config}
+        self.snapshots[here] = snapshot
         try:
-            os.mkdir(".task")
-        except Exception as err:
-            error("CANNOT_INIT", f"Cannot init task database here: {err}")
-        else:
-            print("Empty taskwarrior database initialized in", pathlib.Path.cwd())
-            sys.exit(0)
+            path = self.path(here)
+            path.parent.mkdir(parents = True, exist_ok = True)
+            tmp = path.with_suffix(f".{os.getpid()}.tmp")
+            with open(tmp, "wb") as fd:
+                pickle.dump(snapshot, fd, protocol = pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, path)
+        except OSError as exc:
+            logging.warning(f"Cannot write the config snapshot: {exc}")
+        return config
+
+config_snapshots = ConfigSnapshots()
+
+
+def make_projection(config):
+    """The Projection of the tasks on the displayed fields, if `data.compact` is set."""
+    if as_bool(config["data.compact"]):
+        fields = projected_fields(config)
+        if fields:
+            return Projection(fields)
+    return None
 
-    # First pass arguments to taskwarrior and let it do its magic.
-    out = call_taskwarrior(cmd, taskfile)
-    touched = []
-    if "Description" not in out:
-        print(out.strip())
-    touched = parse_touched(out)
 
-    # Then call again to get the resulting data.
-    if as_bool(config["list.filtered"]):
-        filter = parse_filter(cmd)
-        jdata = get_data(taskfile, filter)
+def load_data(taskfile, config, cache = False):
+    projection = make_projection(config)
+    if as_bool(config["data.native"]):
+        jdata = read_data(taskfile, config, completed = wants_completed(config))
+        return [projection(t) for t in jdata] if projection else jdata
     else:
-        jdata = get_data(taskfile, filter = None)
-        if not jdata:
-            error("NO_DATA", f"Failed to get data from taskfile {taskfile}")
-
-        # If no explicit touch from an editing command,
-        # then just point out tasks matching the filter.
-        if not touched:
-            filter = parse_filter(cmd)
-            filtered = get_data(taskfile, filter)
-            if len(filtered) != len(jdata):
-                touched = [str(t["id"]) for t in filtered]
+        return get_data(taskfile, filter = None, cache = cache, projection = projection)
+
+
+class TaskStore:
+    """Tasks of the databases, kept as long as their data files do not change.
+
+    A fresh store is used for each run of the command line,
+    the daemon keeps one across requests.
+    """
+    def __init__(self):
+        self.entries = {}
+        self.lock = threading.RLock()
+
+    def key(self, taskfile, config):
+        path = str(pathlib.Path(os.path.expanduser(str(taskfile))).resolve())
+        projection = make_projection(config)
+        return (path, as_bool(config["data.native"]), wants_completed(config), projection.fields if projection else ())
+
+    def get(self, taskfile, config, cache = False):
+        key = self.key(taskfile, config)
+        signature = export_cache.signature(taskfile)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry["signature"] == signature \
+               and time.time() - entry["time"] < export_cache.ttl:
+                return entry["tasks"]
+        # Not holding the lock, so that several databases can be loaded at once.
+        jdata = load_data(taskfile, config, cache)
+        if jdata is not None:
+            with self.lock:
+                self.entries[key] = {"signature": signature, "time": time.time(), "tasks": jdata}
+        return jdata
 
-    # print(json.dumps(jdata, indent=4))
+    def refresh(self, taskfile, config, touched):
+        """Update the stored tasks after an editing command.
+
+        Only the touched tasks are exported again, if the command does not
+        tell which tasks it touched, the database will be entirely reloaded.
+        """
+        key = self.key(taskfile, config)
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if not entry or not touched or as_bool(config["data.native"]):
+                return
+            signature = export_cache.signature(taskfile)
+            try:
+                fresh = get_data(taskfile, [",".join(touched)], projection = make_projection(config))
+            except ExportError as exc:
+                logging.debug(f"Reloading the whole database: {exc}")
+                return
+            by_uuid = {t["uuid"]: t for t in fresh}
+            tasks = [by_uuid.pop(t["uuid"], t) for t in entry["tasks"]]
+            tasks += by_uuid.values()
+            self.entries[key] = {"signature": signature, "time": entry["time"], "tasks": tasks}
+
+    def expire(self, taskfile):
+        """Forget about the tasks of a database that changed on disk."""
+        path = str(pathlib.Path(os.path.expanduser(str(taskfile))).resolve())
+        signature = export_cache.signature(path)
+        with self.lock:
+            for key in [k for k in self.entries if k[0] == path]:
+                if self.entries[key]["signature"] != signature:
+                    del self.entries[key]
+
+    def taskfiles(self):
+        with self.lock:
+            return {k[0] for k in self.entries}
+
+    def config(self, config):
+        """Return an already known config if it is the same than the given one.
+
+        Keeping the same object allows to reuse what was compiled from it.
+        """
+        with self.lock:
+            if not hasattr(self, "configs"):
+                self.configs = []
+            for known in self.configs:
+                if known == config:
+                    return known
+            self.configs = self.configs[-7:] + [config]
+            return config
+
+
+class DataWatcher:
+    """Tell which task databases had their `.data` files changed.
+
+    Uses inotify through the `inotify_simple` module if it is installed,
+    else polls the files.
+    """
+    def __init__(self, poll = 1.0):
+        self.poll = poll
+        self.signatures = {}
+        self.watches = {}
+        try:
+            import inotify_simple
+            self.inotify = inotify_simple.INotify()
+            self.flags = inotify_simple.flags
+        except (ImportError, OSError):
+            self.inotify = None
+
+    def add(self, taskfile):
+        path = str(pathlib.Path(os.path.expanduser(str(taskfile))).resolve())
+        if path in self.signatures:
+            return
+        self.signatures[path] = export_cache.signature(path)
+        if self.inotify:
+            try:
+                wd = self.inotify.add_watch(path, self.flags.CLOSE_WRITE | self.flags.MOVED_TO | self.flags.CREATE | self.flags.DELETE)
+            except OSError as exc:
+                logging.warning(f"Cannot watch {path}: {exc}")
+            else:
+                self.watches[wd] = path
+
+    def wait(self, timeout = None):
+        """Wait at most `timeout` seconds for changes, return the changed databases."""
+        if timeout is None:
+            timeout = self.poll
+        if self.inotify:
+            events = self.inotify.read(timeout = int(timeout * 1000))
+            candidates = {self.watches[e.wd] for e in events if e.wd in self.watches and e.name.endswith(".data")}
+        else:
+            time.sleep(timeout)
+            candidates = list(self.signatures)
+        changed = set()
+        for path in candidates:
+            signature = export_cache.signature(path)
+            if signature != self.signatures[path]:
+                self.signatures[path] = signature
+                changed.add(path)
+        return changed
+
+
+def daemon_socket():
+    runtime = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime:
+        return pathlib.Path(runtime) / "taskwarrior-deluxe.sock"
+    else:
+        return pathlib.Path(os.environ.get("TMPDIR", "/tmp")) / f"taskwarrior-deluxe-{os.getuid()}.sock"
+
+
+# Messages between the daemon and its clients are frames made of
+# a kind byte, the length of the payload and the payload.
+# The client sends a request (b"r"), the daemon answers with
+# standard output (b"o") and error (b"e") chunks, and ends with the exit code (b"x").
+def send_frame(sock, kind, payload):
+    sock.sendall(kind + struct.pack("!I", len(payload)) + payload)
+
+
+def recv_frame(sock):
+    def recv_exact(n):
+        data = b""
+        while len(data) < n:
+            chunk = sock.recv(n - len(data))
+            if not chunk:
+                raise ConnectionError("connection closed")
+            data += chunk
+        return data
+    header = recv_exact(5)
+    size, = struct.unpack("!I", header[1:])
+    return header[:1], recv_exact(size)
+
+
+class FrameWriter(io.TextIOBase):
+    """Text stream sending what is written to a socket, as frames of the given kind."""
+    def __init__(self, sock, kind, tty = False):
+        self.sock = sock
+        self.kind = kind
+        self.tty = tty
+
+    def write(self, text):
+        if text:
+            send_frame(self.sock, self.kind, text.encode("utf-8"))
+        return len(text)
+
+    def isatty(self):
+        return self.tty
+
+
+def serve(path, poll = 1.0):
+    """Answer the requests of twd calls, until interrupted.
+
+    Configs, tasks and compiled swatches are kept in memory,
+    the tasks being dropped as soon as their database change on disk.
+    """
+    if path.exists():
+        probe = socket.socket(socket.AF_UNIX)
+        try:
+            probe.connect(str(path))
+        except OSError:
+            path.unlink() # Stale socket.
+        else:
+            probe.close()
+            print(f"A daemon is already listening on {path}", file=sys.stderr)
+            return 1
+
+    # Log in the daemon's output, not in the clients'.
+    logging.basicConfig()
+    store = TaskStore()
+    watcher = DataWatcher(poll)
+    def watch():
+        while True:
+            for taskfile in watcher.wait():
+                store.expire(taskfile)
+    threading.Thread(target = watch, daemon = True).start()
+
+    server = socket.socket(socket.AF_UNIX)
+    server.bind(str(path))
+    os.chmod(path, 0o600)
+    server.listen()
+    home = os.getcwd()
+    environ = dict(os.environ)
+    try:
+        while True:
+            conn, _ = server.accept()
+            with conn:
+                try:
+                    kind, payload = recv_frame(conn)
+                    request = json.loads(payload)
+                except (ConnectionError, ValueError) as exc:
+                    logging.warning(f"Bad request: {exc}")
+                    continue
+                out = FrameWriter(conn, b"o", request["tty"])
+                err = FrameWriter(conn, b"e")
+                try:
+                    os.chdir(request["cwd"])
+                    os.environ.clear()
+                    os.environ.update(request["env"])
+                    with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+                        try:
+                            code = main(request["argv"], store = store, console_options = {
+                                "file": out, "force_terminal": True if request["tty"] else None, "width": request["width"]})
+                        except SystemExit as exc:
+                            code = exc.code if isinstance(exc.code, int) else 1
+                        except Exception as exc:
+                            logging.exception(exc)
+                            code = 1
+                    send_frame(conn, b"x", str(code).encode())
+                except (ConnectionError, OSError) as exc:
+                    logging.warning(f"Client left: {exc}")
+                finally:
+                    os.chdir(home)
+                    os.environ.clear()
+                    os.environ.update(environ)
+                for taskfile in store.taskfiles():
+                    watcher.add(taskfile)
+    except KeyboardInterrupt:
+        return 0
+    finally:
+        server.close()
+        path.unlink(missing_ok = True)
+
+
+def forward(argv, path):
+    """Let a running daemon handle the call.
+
+    Returns its exit code, or None if there is no daemon.
+    """
+    if not path.exists():
+        return None
+    sock = socket.socket(socket.AF_UNIX)
+    try:
+        sock.connect(str(path))
+    except OSError:
+        return None
+    with sock:
+        request = {
+            "argv": argv,
+            "cwd": os.getcwd(),
+            "env": dict(os.environ),
+            "tty": sys.stdout.isatty(),
+            "width": shutil.get_terminal_size().columns,
+        }
+        try:
+            send_frame(sock, b"r", json.dumps(request).encode("utf-8"))
+        except OSError as exc:
+            # Nothing was run yet, do it ourselves.
+            logging.warning(f"Cannot send the request to the daemon: {exc}")
+            return None
+        try:
+            while True:
+                kind, payload = recv_frame(sock)
+                if kind in [b"o", b"e"]:
+                    stream = sys.stdout if kind == b"o" else sys.stderr
+                    try:
+                        stream.buffer.write(payload)
+                        stream.flush()
+                    except BrokenPipeError:
+                        # The reader did not want more (e.g. `head`), do not fail again when exiting.
+                        try:
+                            os.dup2(os.open(os.devnull, os.O_WRONLY), stream.fileno())
+                        except OSError:
+                            pass
+                        return 0
+                elif kind == b"x":
+                    return int(payload)
+        except ConnectionError as exc:
+            print("ERROR: the daemon did not finish answering:", exc, file=sys.stderr)
+            return 1
+
+
+def sub_taskfiles(cwd, taskfile, config, cache = True):
+    """Task databases of the immediate subdirectories, other than the given one."""
+    index = repo_index(cwd, config, depth = 1, cache = cache)
+    return [t for t in index.children() if t != taskfile]
+
+
+def repo_taskfiles(cwd, config, cache = True, index = None):
+    """Databases at and under the given directory, parents before their children."""
+    if index is None:
+        index = repo_index(cwd, config, cache = cache)
+    taskfiles = []
+    if (cwd / ".task") == index.enclosing(cwd):
+        taskfiles.append(cwd / ".task")
+    def walk(path):
+        for child in index.children(path):
+            taskfiles.append(child)
+            walk(child.parent)
+    walk(cwd)
+    return taskfiles
+
+
+def make_tree(cwd, config, cache = True):
+    """Tree of the databases under the given directory, with their number of tasks."""
+    index = repo_index(cwd, config, cache = cache)
+    taskfiles = repo_taskfiles(cwd, config, cache, index)
+    counts = dict(RepoCounts(taskfiles, jobs = int(config["repos.jobs"]), timeout = float(config["repos.timeout"])))
 
+    w = Widget(config)
+    def label(name, taskfile):
+        text = w.rtext(f"{name}/", swatch="taskdir", end="")
+        if taskfile in counts:
+            count = counts[taskfile]
+            text.append(" ")
+            text.append_text(w.rtext(f"{count} tasks" if count is not None else "?", swatch="parentdir.tasks", end=""))
+        return text
+    def add(node, path):
+        for child in index.children(path):
+            # Path relative to the parent database.
+            add(node.add(label(os.path.relpath(child.parent, path), child)), child.parent)
+    tree = rich.tree.Tree(label(cwd.name, cwd / ".task"))
+    add(tree, cwd)
+    return tree
+
+
+def make_layout(config, touched = []):
+    """Build the sections, stacks and tasks widgets configured to display the tasks."""
     list_separator = ","
     showed = config["report.list.columns"].split(list_separator)
     if not showed:
@@ -801,7 +3288,6 @@ if __name__ == "__main__":
         if field and field in show_only:
             show_only.pop(show_only.index(field))
 
-    swatch = rich.theme.Theme(get_swatch(config))
     layouts = get_layouts()
 
     ##### Tasks #####
@@ -879,28 +3365,552 @@ if __name__ == "__main__":
     else:
         sectioner = layouts["sections"][config["layout.sections"]](config, stacker, g_sort_on, group_by)
 
-    console = Console(theme = swatch)
+    return sectioner
+
+
+class StackCache:
+    """Wrap a stacker, keeping the stacks it made as long as their tasks do not change.
+
+    Stacks that were not used since the last `flush` are forgotten.
+    """
+    def __init__(self, stacker):
+        self.stacker = stacker
+        self.sorter = stacker.sorter
+        self.stacks = {}
+        self.used = {}
+
+    def limited(self):
+        return self.stacker.limited()
+
+    def key(self, tasks):
+        touched = self.stacker.tasker.touched
+        return tuple((t.get("uuid"), t.get("modified"), t.get("id"), str(t.get("id")) in touched) for t in tasks)
+
+    def __call__(self, tasks):
+        key = self.key(tasks)
+        if key not in self.stacks:
+            self.stacks[key] = self.stacker(tasks)
+        self.used[key] = self.stacks[key]
+        return self.used[key]
+
+    def flush(self):
+        self.stacks, self.used = self.used, {}
+
+    def clear(self):
+        self.stacks, self.used = {}, {}
+
+
+def watch_board(taskfile, config, store, console, filter = [], cache = False):
+    """Display the tasks and update the display each time the database changes.
+
+    Only the stacks holding changed tasks are made again,
+    all of them are when relative dates are refreshed.
+    Changed tasks are highlighted for `watch.touched` seconds.
+    """
+    touched = []
+    sectioner = make_layout(config, touched)
+    inner = sectioner
+    while isinstance(inner.stacker, Sectioner):
+        inner = inner.stacker
+    stacks = inner.stacker = StackCache(inner.stacker)
+    # Cached stacks are only reused if made in this process.
+    render_pool.jobs = 0
+
+    watcher = DataWatcher(float(config["watch.poll"]))
+    watcher.add(taskfile)
+    keep = float(config["watch.touched"])
+    dates_every = float(config["watch.dates"])
+
+    w = Widget(config)
+    name = pathlib.Path(os.path.expanduser(str(taskfile))).resolve().parent.name
+    title = rich.rule.Rule(w.rtext(name, swatch="taskdir"), style=config.get("color.taskdir", ""))
+
+    # Modification stamps of the tasks, and when they changed.
+    modified = None
+    changed_at = {}
+    dates_at = time.time()
+    reload = True
+    try:
+        with rich.live.Live(console = console, screen = True, auto_refresh = False) as live:
+            while True:
+                now = time.time()
+                if reload:
+                    try:
+                        jdata = store.get(taskfile, config, cache = cache) or []
+                        jdata = filter_data(jdata, filter, taskfile, cache)
+                    except ExportError as exc:
+                        # Keep showing the last board, until the next change.
+                        logging.warning(f"Failed to get data from taskfile {taskfile}: {exc}")
+                        if modified is None:
+                            raise
+                    if modified is not None:
+                        for t in jdata:
+                            if modified.get(t.get("uuid")) != t.get("modified"):
+                                changed_at[t.get("uuid")] = now
+                    modified = {t.get("uuid"): t.get("modified") for t in jdata}
+                if now - dates_at >= dates_every:
+                    Dates.reset()
+                    stacks.clear()
+                    dates_at = now
+                changed_at = {u:at for u,at in changed_at.items() if now - at < keep}
+                touched[:] = [str(t["id"]) for t in jdata if t.get("uuid") in changed_at]
+
+                live.update(rich.console.Group(title, sectioner(jdata)), refresh = True)
+                stacks.flush()
+
+                # Sleep until the data change, or until dates or highlights are outdated.
+                wakeups = [dates_at + dates_every] + [at + keep for at in changed_at.values()]
+                reload = False
+                while not reload and time.time() < min(wakeups):
+                    changed = watcher.wait(max(0.01, min(watcher.poll, min(wakeups) - time.time())))
+                    if changed:
+                        store.expire(taskfile)
+                        reload = True
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def repo_name(taskfile, cwd):
+    """Path of the directory holding the database, relative to the current one."""
+    relp = os.path.relpath(taskfile.parent, cwd)
+    return cwd.name if relp == "." else relp
+
+
+def repos_board(cwd, config, store, console, options = {}, filter = None, cache = False):
+    """Display the tasks of all the databases under the current directory, on a single board.
+
+    Databases are exported concurrently, and are an additional section level,
+    above the configured ones.
+    Databases that fail are reported after the board, without preventing the others to show.
+    Without a console, the tasks are written in the configured output format.
+    """
+    with timings.span("scan"):
+        taskfiles = repo_taskfiles(cwd, config, cache)
+    if not taskfiles:
+        error("NO_DATA_FILE", "Cannot find a data file here, or in subdirectories.")
+    names = {t: repo_name(t, cwd) for t in taskfiles}
+    exports = RepoTasks(taskfiles, config, store, filter, cache, jobs = int(config["repos.jobs"]))
+
+    # Task IDs are not unique across databases, do not highlight any.
+    sectioner = make_layout(config)
+    by_repo = group.Repo()
+    repos = get_layouts("sections", config["layout.repos"])(config, sectioner,
+        group.sort.OnValues([names[t] for t in taskfiles]), by_repo)
+    failed = []
+    if console is None:
+        jdata = []
+        for taskfile,tasks,exc in exports:
+            if tasks:
+                by_repo.add(names[taskfile], tasks)
+                jdata += tasks
+        mark("render")
+        return write_board(output_format(options, config), repos, jdata)
+
+    w = Widget(config)
+    console.rule(w.rtext(str(cwd.name), swatch="taskdir"), style=config["color.taskdir"])
+
+    mark("render")
+    if options.get("stream") or as_bool(config["layout.stream"]):
+        # Print each database as soon as it is exported.
+        limit = options.get("limit", config["layout.stream.limit"])
+        limit = int(limit) if limit else None
+        printed = 0
+        for taskfile,tasks,exc in exports:
+            if exc:
+                failed.append( (taskfile, exc) )
+            elif tasks and (limit is None or printed < limit):
+                title, style = repos.heading(names[taskfile])
+                console.rule(title, style = style, align = "left")
+                printed += sectioner.stream(tasks, console, chunk = int(config["layout.stream.chunk"]),
+                    limit = None if limit is None else limit - printed)
+    else:
+        jdata = []
+        for taskfile,tasks,exc in exports:
+            if exc:
+                failed.append( (taskfile, exc) )
+            elif tasks:
+                by_repo.add(names[taskfile], tasks)
+                jdata += tasks
+        with timings.span("widgets"):
+            board = repos(jdata)
+        with timings.span("rich.print"):
+            console.print(board)
+
+    for taskfile,exc in failed:
+        console.print(w.rtext(f"{names[taskfile]}: ", swatch="parentdir"), end="")
+        console.print(w.rtext(f"cannot export tasks ({exc})", swatch="parentdir.tasks"))
+    return 0
+
+
+class Summary:
+    """Number of tasks per section and subsection of a database, and its due dates.
+
+    Kept in `twd-summary.json` in the data directory, along with the signature
+    of the data files it counts, and rebuilt from an export if they changed.
+    The taskwarrior hooks of the `hooks` directory update it after each task addition
+    or modification. As on-add and on-modify run before taskwarrior writes the data files,
+    they leave it pending, and on-exit signs it once the files are written.
+    """
+    name = "twd-summary.json"
+
+    def __init__(self, fields):
+        self.fields = list(fields)
+        self.groupers = [group.Status() if f == "status" else group.Field(f) for f in self.fields]
+        # Section: {"count": n, "groups": {subsection: n}}
+        self.counts = {}
+        # UUID: due date, of pending tasks.
+        self.due = {}
+
+    @staticmethod
+    def fields_of(config):
+        """Grouped fields of the sections and subsections."""
+        fields = [config["layout.sections.group"] or "status"]
+        if config["layout.subsections"] and config["layout.subsections.group"]:
+            fields.append(config["layout.subsections.group"])
+        return ["status" if f.lower() == "status" else f for f in fields]
+
+    @classmethod
+    def path(cls, taskfile):
+        return pathlib.Path(os.path.expanduser(str(taskfile))) / cls.name
+
+    @staticmethod
+    def signature(taskfile):
+        data = pathlib.Path(os.path.expanduser(str(taskfile)))
+        # Without the paths, which depend on how the database is reached.
+        return [list(sig[1:]) for sig in file_signature([data / f for f in ExportCache.data_files])]
+
+    @classmethod
+    def read(cls, taskfile):
+        try:
+            with open(cls.path(taskfile)) as fd:
+                return json.load(fd)
+        except (OSError, ValueError):
+            return None
+
+    @classmethod
+    def load(cls, taskfile, fields = None, pending = False):
+        """The summary of the database, None if missing, outdated or made for other fields.
+
+        With `pending`, a summary updated by hooks of a command whose changes
+        are not written yet is valid as well.
+        """
+        stored = cls.read(taskfile)
+        if stored is None:
+            return None
+        signature = cls.signature(taskfile)
+        if stored.get("signature") != signature \
+           and not (pending and stored.get("signature") is None and stored.get("base") == signature):
+            return None
+        if fields is not None and stored.get("fields") != list(fields):
+            return None
+        return cls.of(stored)
+
+    @classmethod
+    def of(cls, stored):
+        summary = cls(stored["fields"])
+        summary.counts = stored["counts"]
+        summary.due = stored["due"]
+        return summary
+
+    def save(self, taskfile, signature, base = None):
+        """Store the summary of the data files of the given `signature`, or pending changes made on `base`."""
+        path = self.path(taskfile)
+        try:
+            tmp = path.with_suffix(f".{os.getpid()}.tmp")
+            with open(tmp, "w") as fd:
+                json.dump({"fields": self.fields, "counts": self.counts, "due": self.due,
+                    "signature": signature, "base": base}, fd)
+            os.replace(tmp, path)
+        except OSError as exc:
+            logging.warning(f"Cannot write the summary: {exc}")
+
+    def add(self, task, n = 1):
+        """Count the task, or forget it with a negative `n`."""
+        keys = [g.key(task) for g in self.groupers]
+        if keys[0] is not None:
+            section = self.counts.setdefault(str(keys[0]), {"count": 0, "groups": {}})
+            section["count"] += n
+            if len(keys) > 1 and keys[1] is not None:
+                groups = section["groups"]
+                groups[str(keys[1])] = groups.get(str(keys[1]), 0) + n
+                if groups[str(keys[1])] <= 0:
+                    del groups[str(keys[1])]
+            if section["count"] <= 0:
+                del self.counts[str(keys[0])]
+        if n < 0:
+            self.due.pop(task.get("uuid"), None)
+        elif task.get("status") == "pending" and task.get("due"):
+            self.due[task["uuid"]] = task["due"]
+
+    def build(self, tasks):
+        for task in tasks:
+            self.add(task)
+        return self
+
+    def next_due(self, n = None):
+        return sorted(self.due.values())[:n]
+
+    def overdue(self):
+        now = time.strftime("%Y%m%dT%H%M%SZ", time.gmtime())
+        return sum(1 for d in self.due.values() if d < now)
+
+
+def summary_hook(argv, stdin = sys.stdin, stdout = sys.stdout, event = "on-add"):
+    """Taskwarrior on-add, on-modify and on-exit hook, updating the summary of the database.
+
+    The task is always given back to taskwarrior. A missing or outdated
+    summary is left as is, to be rebuilt by the next `twd summary`.
+    """
+    lines = [line for line in stdin.read().splitlines() if line.strip()]
+    if lines and event != "on-exit":
+        stdout.write(lines[-1] + "\n")
+        stdout.flush()
+    data = [a[len("data:"):] for a in argv if a.startswith("data:")]
+    if not data:
+        return 0
+    if event == "on-exit":
+        stored = Summary.read(data[0])
+        if stored and stored.get("signature") is None:
+            if lines:
+                # The changes counted by the other hooks are now written.
+                Summary.of(stored).save(data[0], Summary.signature(data[0]))
+            else:
+                # The command was aborted, what was counted did not happen.
+                Summary.path(data[0]).unlink(missing_ok = True)
+        return 0
+    if not lines:
+        return 0
+    summary = Summary.load(data[0], pending = True)
+    if summary is None:
+        return 0
+    try:
+        tasks = [json.loads(line) for line in lines]
+    except ValueError:
+        return 0
+    if len(tasks) > 1:
+        summary.add(tasks[0], -1)
+    summary.add(tasks[-1])
+    summary.save(data[0], None, base = Summary.signature(data[0]))
+    return 0
+
+
+def print_summary(taskfile, config, format = "rich", cache = True):
+    """Print the number of tasks per section, the overdue ones and the next due date, on a single line.
+
+    Only reads the summary file, unless it has to be rebuilt.
+    """
+    fields = Summary.fields_of(config)
+    summary = Summary.load(taskfile, fields) if cache else None
+    if summary is None:
+        # Taken before reading, so that a write meanwhile outdates the new summary.
+        signature = Summary.signature(taskfile)
+        if as_bool(config["data.native"]):
+            tasks = read_data(taskfile, config)
+        else:
+            try:
+                tasks = get_data(taskfile)
+            except ExportError as exc:
+                error("NO_DATA", f"Failed to get data from taskfile {taskfile}: {exc}")
+        summary = Summary(fields).build(tasks)
+        summary.save(taskfile, signature)
+
+    due = int(config["summary.due"])
+    if format == "json":
+        print(json.dumps({"fields": summary.fields, "counts": summary.counts,
+            "overdue": summary.overdue(), "due": summary.next_due(due)}))
+        return 0
+
+    shown = config["layout.sections.group.show"].split(",")
+    if shown == [""]:
+        shown = {"status": ["pending", "started", "completed"], "priority": ["H", "M", "L", ""]}.get(fields[0].lower(), [])
+    keys = [k for k in shown if k in summary.counts] or list(summary.counts)
+    words = []
+    for k in keys:
+        section = summary.counts[k]
+        word = f"{k or '-'}:{section['count']}"
+        if section["groups"]:
+            word += "[" + ",".join(f"{g or '-'}:{n}" for g,n in section["groups"].items()) + "]"
+        words.append(word)
+    overdue = summary.overdue()
+    if overdue:
+        words.append(f"overdue:{overdue}")
+    for d in summary.next_due(due):
+        words.append(f"due:{d[0:4]}-{d[4:6]}-{d[6:8]}")
+    print(" ".join(words))
+    return 0
+
+
+def main(argv, console_options = None, store = None):
+    """Run taskwarrior with the given arguments, then display the tasks."""
+    options, cmd = parse_options(argv)
+    if options.get("profile-startup"):
+        atexit = timed_import("atexit")
+        atexit.register(report_startup)
+    if options.get("timings"):
+        timings.enable()
+    if options.get("profile"):
+        profiler = timed_import("cProfile").Profile()
+        profiler.enable()
+    try:
+        return run(options, cmd, console_options, store)
+    finally:
+        if options.get("profile"):
+            profiler.disable()
+            profiler.dump_stats(options["profile"] if options["profile"] is not True else "twd.pstats")
+        if options.get("timings"):
+            timings.disable()
+            timings.report("json" if options["timings"] == "json" else "table")
+
+
+def run(options, cmd, console_options = None, store = None):
+    # Dates are relative to the time of this run.
+    Dates.reset()
+    if store is None:
+        store = TaskStore()
+
+    # Does not need any config.
+    if len(cmd) == 1 and cmd[0] == "init":
+        try:
+            os.mkdir(".task")
+        except Exception as err:
+            error("CANNOT_INIT", f"Cannot init task database here: {err}")
+        else:
+            print("Empty taskwarrior database initialized in", pathlib.Path.cwd())
+            return 0
+
+    mark("config")
+    config = store.config(load_config(cache = not options.get("no-cache")))
+    render_pool.configure(config)
+
+    # for k in config:
+    #     print(k,"=",config[k])
+
+    use_cache = as_bool(config["data.cache"]) and not options.get("no-cache")
+    format = output_format(options, config)
+
+    if len(cmd) == 1 and cmd[0] == "tree":
+        console = rich.console.Console(theme = rich.theme.Theme(get_swatch(config)), **(console_options or {}))
+        console.print(make_tree(pathlib.Path.cwd(), config, use_cache))
+        return 0
+
+    taskfile = find_tasks(".task", pathlib.Path.cwd(), config)
+    # A merged board does not need a database in the current directory.
+    if not taskfile and not (options.get("repos") and is_report(cmd)):
+        error("NO_DATA_FILE", "Cannot find a data file here, in a parent directory, or configured.")
+
+    export_cache.ttl = float(config["data.cache.ttl"])
+
+    # Overrides taskwarrior's own summary report.
+    if cmd == ["summary"]:
+        return print_summary(taskfile, config, format, use_cache)
+
+    if cmd and cmd[0] == "watch":
+        console = rich.console.Console(theme = rich.theme.Theme(get_swatch(config)), **(console_options or {}))
+        return watch_board(taskfile, config, store, console, cmd[1:], use_cache)
+
+    # First pass arguments to taskwarrior and let it do its magic.
+    # Reports are not needed, as TWD will display the tasks itself.
+    touched = []
+    if cmd and cmd[0] == "batch":
+        mark("taskwarrior")
+        if len(cmd) > 1:
+            with open(cmd[1]) as fd:
+                touched = batch(fd.readlines(), taskfile)
+        else:
+            touched = batch(sys.stdin.readlines(), taskfile)
+        store.refresh(taskfile, config, [])
+        cmd = []
+    elif not is_report(cmd):
+        mark("taskwarrior")
+        out = call_taskwarrior(cmd, taskfile)
+        # Keep the standard output to the tasks, for other programs.
+        said = sys.stdout if format == "rich" else sys.stderr
+        if not as_bool(config["list.edited"]):
+            # Just like taskwarrior, without any rendering.
+            print(out.strip(), file = said)
+            return 0
+        if "Description" not in out:
+            print(out.strip(), file = said)
+        touched = parse_touched(out)
+        store.refresh(taskfile, config, touched)
+
+    if options.get("repos"):
+        console = None
+        if format == "rich":
+            console = rich.console.Console(theme = rich.theme.Theme(get_swatch(config)), **(console_options or {}))
+        # Tasks are not highlighted but filtered, bare filters included.
+        filter = parse_filter(cmd) if is_report(cmd) else []
+        if filter is None:
+            filter = cmd
+        return repos_board(pathlib.Path.cwd(), config, store, console, options, filter, use_cache)
+
+    mark("data")
+
+    # Then call again to get the resulting data.
+    # Filtered views are derived from this single export.
+    try:
+        jdata = store.get(taskfile, config, cache = use_cache)
+        if as_bool(config["list.filtered"]):
+            if jdata is None:
+                error("NO_DATA", f"Failed to get data from taskfile {taskfile}")
+            jdata = filter_data(jdata, parse_filter(cmd), taskfile, use_cache)
+        else:
+            if not jdata:
+                error("NO_DATA", f"Failed to get data from taskfile {taskfile}")
+
+            # If no explicit touch from an editing command,
+            # then just point out tasks matching the filter.
+            if not touched:
+                filtered = filter_data(jdata, parse_filter(cmd), taskfile, use_cache)
+                if len(filtered) != len(jdata):
+                    touched = [str(t["id"]) for t in filtered]
+    except ExportError as exc:
+        error("NO_DATA", f"Failed to get data from taskfile {taskfile}: {exc}")
+
+    # Batches tell the UUIDs of the tasks they touched.
+    uuids = {t for t in touched if not t.isdigit()}
+    if uuids:
+        touched = [t for t in touched if t.isdigit()] + [str(t["id"]) for t in jdata if t.get("uuid") in uuids and t.get("id")]
+
+    # print(json.dumps(jdata, indent=4))
+
+    mark("layout")
+    sectioner = make_layout(config, touched)
+    if format != "rich":
+        mark("render")
+        return write_board(format, sectioner, jdata)
+    swatch = rich.theme.Theme(get_swatch(config))
+    console = rich.console.Console(theme = swatch, **(console_options or {}))
 
     # Display the basename of the directory holding the database.
     task_dir = taskfile.parent
     cwd = pathlib.Path.cwd()
     relp = pathlib.Path(os.path.relpath(task_dir, cwd))
     w = Widget(config)
+
+    # Start counting tasks in the upper directory and in immediate subdirs,
+    # while rendering the main display.
+    uptaskfile = None
+    if relp != '.':
+        uptaskfile = find_tasks(".task", task_dir.parent, config)
+    with timings.span("scan"):
+        downtaskfiles = sub_taskfiles(cwd, taskfile, config, use_cache)
+    counts = iter(RepoCounts(([uptaskfile] if uptaskfile else []) + downtaskfiles,
+        jobs = int(config["repos.jobs"]), timeout = float(config["repos.timeout"])))
+
     if relp == '.':
         # Just the name of the current dir.
         console.rule(w.rtext(str(task_dir.name), swatch="taskdir"), style=config["color.taskdir"])
     else:
         # Display a number of tasks in an upper directory.
-        uptaskfile = find_tasks(".task", task_dir.parent, config)
         if uptaskfile:
             uprelp = pathlib.Path(os.path.relpath(task_dir.parent, cwd))
             upreli = re.sub(r"\.\./*", "⮤", str(uprelp))
-            upjdata = get_data(uptaskfile)
-            try:
+            _, upcount = next(counts)
+            if upcount is not None:
                 console.print(w.rtext(f"{upreli} {uptaskfile.parent.name}/: ", swatch="parentdir"), end="")
-                console.print(w.rtext(f"{len(upjdata)} tasks", swatch="parentdir.tasks"))
-            except:
-                pass
+                console.print(w.rtext(f"{upcount} tasks", swatch="parentdir.tasks"))
 
         # Relative path to the directory holding the task files.
         rela = re.sub(r"\.\./*", "⮤", str(relp))
@@ -911,16 +3921,46 @@ if __name__ == "__main__":
             console.rule(w.rtext(f"{task_dir.name}", swatch="taskdir"), style=config["color.taskdir"])
 
     # Main display.
-    console.print(sectioner(jdata))
+    mark("render")
+    if options.get("stream") or as_bool(config["layout.stream"]):
+        limit = options.get("limit", config["layout.stream.limit"])
+        sectioner.stream(jdata, console, chunk = int(config["layout.stream.chunk"]),
+            limit = int(limit) if limit else None)
+    else:
+        with timings.span("widgets"):
+            board = sectioner(jdata)
+        with timings.span("rich.print"):
+            console.print(board)
 
     # Number of tasks in immediate subdirs.
-    for f in os.scandir(cwd):
-        if f.is_dir():
-            downtaskfile = find_tasks(".task", pathlib.Path(f), config)
-            if downtaskfile and downtaskfile != taskfile:
-                downrelp = pathlib.Path(os.path.relpath(task_dir.parent, cwd))
-                downreli = re.sub(r"\.\./*", "⮧ ", str(downrelp))
-                downjdata = get_data(downtaskfile)
-                console.print(w.rtext(f"{downreli}./{downtaskfile.parent.name}: ", swatch="parentdir"), end="")
-                console.print(w.rtext(f"{len(downjdata)} tasks", swatch="parentdir.tasks"))
+    mark("repositories")
+    for downtaskfile,downcount in counts:
+        if downcount is not None:
+            downrelp = pathlib.Path(os.path.relpath(task_dir.parent, cwd))
+            downreli = re.sub(r"\.\./*", "⮧ ", str(downrelp))
+            console.print(w.rtext(f"{downreli}./{downtaskfile.parent.name}: ", swatch="parentdir"), end="")
+            console.print(w.rtext(f"{downcount} tasks", swatch="parentdir.tasks"))
+
+    if use_cache:
+        stats = export_cache.record_stats()
+        if options.get("cache-stats"):
+            total = stats["hit"] + stats["miss"]
+            rate = 100 * stats["hit"] / total if total else 0
+            print(f"Export cache: {stats['hit']} hits, {stats['miss']} misses ({rate:.0f}% hits)", file=sys.stderr)
+
+    return 0
 
+
+if __name__ == "__main__":
+    argv = sys.argv[1:]
+    if "--daemon" in argv:
+        sys.exit(serve(daemon_socket()))
+    code = None
+    # Only reports are forwarded: the daemon has neither our standard input nor our terminal,
+    # which editing commands may need (edit, confirmations, undo…), and should not be held by a watch.
+    options, cmd = parse_options(argv)
+    if not options.get("no-daemon") and is_report(cmd):
+        code = forward(argv, daemon_socket())
+    if code is None:
+        code = main(argv)
+    sys.exit(code)
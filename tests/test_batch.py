@@ -0,0 +1,58 @@
+"""Round trip of batched commands through a real taskwarrior, in a temporary database."""
+
+import os
+import sys
+import shutil
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "benchmarks"))
+import run as bench
+
+twd = bench.twd
+
+pytestmark = pytest.mark.skipif(shutil.which("task") is None, reason = "taskwarrior is not installed")
+
+
+@pytest.fixture
+def taskdata(tmp_path, monkeypatch):
+    taskrc = tmp_path / "taskrc"
+    taskrc.write_text("confirmation=off\nverbose=new-id\ndefault.project=inbox\ndefault.priority=M\n")
+    monkeypatch.setenv("TASKRC", str(taskrc))
+    data = tmp_path / "data"
+    data.mkdir()
+    return str(data)
+
+
+def export(taskdata):
+    return {t["description"]: t for t in twd.get_data(taskdata)}
+
+
+def test_add_modify_done(taskdata):
+    twd.batch(["add write the tests +dev", "add review them"], taskdata)
+    tasks = export(taskdata)
+    assert set(tasks) == {"write the tests", "review them"}
+    # Added by taskwarrior, with its defaults.
+    for t in tasks.values():
+        assert t["project"] == "inbox"
+        assert t["priority"] == "M"
+        assert t["status"] == "pending"
+    assert tasks["write the tests"]["tags"] == ["dev"]
+
+    first, second = tasks["write the tests"], tasks["review them"]
+    touched = twd.batch([f"{first['id']} modify +done -dev project:work priority:H", f"{second['uuid']} done"], taskdata)
+    assert touched == [first["uuid"], second["uuid"]]
+    tasks = export(taskdata)
+    assert tasks["write the tests"]["tags"] == ["done"]
+    assert tasks["write the tests"]["project"] == "work"
+    assert tasks["write the tests"]["priority"] == "H"
+    assert tasks["review them"]["status"] == "completed"
+    assert "end" in tasks["review them"]
+
+
+def test_unsupported_words_go_through_taskwarrior(taskdata):
+    twd.batch(["add keep my description"], taskdata)
+    t, = export(taskdata).values()
+    # A virtual tag is not a modification, taskwarrior refuses it.
+    twd.batch([f"{t['id']} modify +OVERDUE"], taskdata)
+    assert export(taskdata)["keep my description"]["description"] == "keep my description"
@@ -0,0 +1,30 @@
+"""Checks of the layouts, on the synthetic databases of the benchmarks."""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "benchmarks"))
+import run as bench
+
+
+@pytest.fixture(scope = "module")
+def root(tmp_path_factory):
+    root = tmp_path_factory.mktemp("board")
+    bench.generate.main([str(root), "--tasks", "300", "--now", "1700000000"])
+    return str(root)
+
+
+def render(root, width, **layout):
+    config, tasks, sectioner = bench.setup_layout(root, **layout)
+    bench.fresh()
+    out = bench.console(config, width = width)
+    out.print(sectioner(tasks))
+    return out.file.getvalue()
+
+
+# At 80 columns and less, the columns have to be collapsed.
+@pytest.mark.parametrize("width", [40, 80, 160])
+def test_kanban_is_horizontal(root, width):
+    assert render(root, width, **bench.kanban) == render(root, width, **bench.horizontal)